@@ -1,37 +1,87 @@
+import time
+from typing import Optional
+
 import pygame
 from ecm3423.scene import Scene
 
+# Longest time in seconds that the update loop will try to catch up on after a slow frame.
+MAX_FRAME_TIME = 0.25
+
 
 def present_scene(
-    scene: Scene, width: int = 800, height: int = 600, title: str = "Scene"
+    scene: Scene, width: int = 800, height: int = 600, title: str = "Scene", idle: bool = True,
+    idle_timeout: int = 1000, update_rate: int = 120, max_fps: Optional[int] = None, vsync: bool = True
 ):
     """
     Present a given Scene object by creating a new window of the given width and height, with a title.
 
+    The scene is updated at a fixed rate, independent of how often it is drawn, and drawn interpolated between its
+    last two updates.
+
     :param scene: a scene to draw
     :param width: the new window's width
     :param height: the new window's height
     :param title: title for the new window
+    :param idle: only redraw when something in the scene has changed, otherwise sleep until an event arrives
+    :param idle_timeout: longest time to sleep in milliseconds when idle, before checking for changes again
+    :param update_rate: number of fixed update steps per second
+    :param max_fps: maximum number of frames to draw per second, or None for no limit
+    :param vsync: whether to synchronise presenting each frame with the display's refresh
     :return:
     """
 
     if not pygame.display.get_driver() in ["x11", "wayland"]:
-        # Set up Pygame to explicitly request an OpenGL 3.2 core profile context on non-Linux systems.
+        # Set up Pygame to explicitly request an OpenGL 3.2 core profile context on non-Linux systems, or 3.3 when the
+        # scene has instanced props, whose per-instance attributes need glVertexAttribDivisor().
         pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
-        pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 2)
+        pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3 if scene.n_props > 0 else 2)
         pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
 
-    screen = pygame.display.set_mode((width, height), pygame.OPENGL | pygame.DOUBLEBUF, 24)
+    try:
+        screen = pygame.display.set_mode((width, height), pygame.OPENGL | pygame.DOUBLEBUF, 24, vsync=int(vsync))
+    except pygame.error:
+        # Not every driver allows the swap interval to be set.
+        screen = pygame.display.set_mode((width, height), pygame.OPENGL | pygame.DOUBLEBUF, 24)
 
     scene.setup(width, height)
 
-    # Our main draw loop.
-    running = True
-    while running:
-        scene.draw()
+    step = 1.0 / update_rate
+    clock = pygame.time.Clock()
+    accumulator = 0.0
+    last_time = time.perf_counter()
+
+    try:
+        # Our main draw loop.
+        running = True
+        while running:
+            if not idle or scene.needs_redraw():
+                # Draw moving objects part way between the last two update steps, by the time left over since the last.
+                scene.draw(accumulator / step)
+                pygame.display.flip()
+
+                if max_fps is not None:
+                    clock.tick(max_fps)
+
+            # Sleep until the next event if there is nothing new to draw.
+            sleeping = idle and not scene.needs_redraw()
+            running = scene.process_events(idle_timeout if sleeping else 0)
 
-        pygame.display.flip()
-        running = scene.process_events()
+            now = time.perf_counter()
+            if sleeping:
+                # Nothing moved whilst asleep, so there is no time to catch up on. Apply whatever input woke us in a
+                # single step, without banking any time towards the next.
+                scene.wake(step)
+                accumulator = 0.0
+            else:
+                # Limit how far behind we can fall, so that a slow frame cannot cause ever more updates to catch up.
+                accumulator += min(now - last_time, MAX_FRAME_TIME)
+                while accumulator >= step:
+                    scene.update(step)
+                    accumulator -= step
+            last_time = now
+    finally:
+        # Release everything whilst the window's context is still current, even if the loop failed.
+        scene.teardown()
 
 
 def main():
@@ -0,0 +1,362 @@
+"""
+CPU-side benchmarks for the hot paths of the renderer. None of these require a display or an OpenGL context.
+
+To record a baseline, then later compare against it:
+
+    $ python3 -m ecm3423.benchmark run -o baseline.json
+    $ python3 -m ecm3423.benchmark run -o current.json
+    $ python3 -m ecm3423.benchmark compare baseline.json current.json --threshold 0.2
+
+compare exits with a non-zero status if any benchmark has slowed down by more than the threshold.
+
+The time taken to draw the default scene in each fur mode is measured separately, in a hidden window:
+
+    $ python3 -m ecm3423.benchmark render --size 1920x1080 -o render.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from os.path import join
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pygame
+from OpenGL.GL import glFinish
+
+from ecm3423 import transforms, util
+from ecm3423.fur_model import FUR_MODES, FUR_MODE_BLEND
+from ecm3423.fur_buffers import build_fur_mesh
+from ecm3423.mesh import Mesh
+from ecm3423.scene import RESOURCE_PATH, Scene
+from ecm3423.shaders import Shaders
+
+# Segment counts used to build synthetic spheres, giving 2 * n * n triangles each.
+SPHERE_SIZES = [8, 16, 32, 64]
+QUICK_SPHERE_SIZES = [8, 16]
+
+# Number of instances used for the batched transform benchmarks.
+BATCH_SIZES = [100, 1000, 10000]
+
+
+def build_sphere_mesh(n: int) -> Tuple[np.array, np.array]:
+    """
+    Build the vertices and triangle faces of a UV sphere with n segments around and n rings from pole to pole.
+
+    :param n: number of segments and rings
+    """
+    theta = np.linspace(0.0, np.pi, n + 1)
+    phi = np.linspace(0.0, 2 * np.pi, n, endpoint=False)
+    theta, phi = np.meshgrid(theta, phi, indexing="ij")
+
+    vertices = np.stack(
+        (np.sin(theta) * np.cos(phi), np.cos(theta), np.sin(theta) * np.sin(phi)), axis=-1
+    ).reshape(-1, 3).astype("f")
+
+    rings, segments = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    a = rings * n + segments
+    b = rings * n + (segments + 1) % n
+    c = a + n
+    d = b + n
+    faces = np.concatenate((
+        np.stack((a, c, b), axis=-1).reshape(-1, 3),
+        np.stack((b, c, d), axis=-1).reshape(-1, 3),
+    )).astype("uint32")
+
+    return vertices, faces
+
+
+def write_obj_file(path: str, vertices: np.array, faces: np.array):
+    """
+    Write the given vertices and triangle faces to a Wavefront OBJ file.
+
+    :param path: path of the file to write
+    :param vertices: (N, 3) array of vertex positions
+    :param faces: (M, 3) array of zero-based vertex indices
+    """
+    with open(path, "w") as fp:
+        fp.write("# synthetic benchmark mesh\n")
+        for v in vertices:
+            fp.write(f"v {v[0]:f} {v[1]:f} {v[2]:f}\n")
+        for f in faces + 1:
+            fp.write(f"f {f[0]} {f[1]} {f[2]}\n")
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, min_time: float = 0.05) -> Dict[str, float]:
+    """
+    Time the given function, returning statistics on the time taken per call in seconds.
+
+    The number of calls per sample is chosen so that each sample takes at least min_time seconds.
+
+    :param fn: function to time
+    :param repeat: number of samples to take
+    :param min_time: minimum duration of each sample in seconds
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "calls": number,
+    }
+
+
+def collect(tmpdir: str, quick: bool = False) -> List[Tuple[str, Callable[[], object]]]:
+    """
+    Build the list of benchmarks to run, as (name, function) pairs.
+
+    :param tmpdir: directory to write synthetic meshes to
+    :param quick: only use the smaller synthetic meshes
+    """
+    benchmarks = []
+    sizes = QUICK_SPHERE_SIZES if quick else SPHERE_SIZES
+
+    # Mesh loading and normal calculation, on the shipped models and on synthetic meshes of growing size.
+    obj_paths = [(name, join(RESOURCE_PATH, "models", f"{name}.obj")) for name in ("bunny_world", "torus")]
+
+    for n in sizes:
+        vertices, faces = build_sphere_mesh(n)
+        path = join(tmpdir, f"sphere_{n}.obj")
+        write_obj_file(path, vertices, faces)
+        obj_paths.append((f"sphere_{faces.shape[0]}", path))
+
+    for name, path in obj_paths:
+        benchmarks.append((f"Mesh.from_obj_file[{name}]", lambda path=path: Mesh.from_obj_file(path)))
+
+    for name, path in obj_paths:
+        mesh = Mesh.from_obj_file(path)
+        benchmarks.append((f"Mesh._calculate_normals[{name}]", mesh._calculate_normals))
+        benchmarks.append(
+            (f"build_fur_mesh[{name}]", lambda mesh=mesh: build_fur_mesh(mesh, 25, 0.1))
+        )
+
+    # Clustering meshes for culling, and culling them from a fixed viewpoint.
+    P = transforms.build_frustum_matrix(-1.0, 1.0, 1.0, -1.0, 1.5, 50)
+    V = transforms.build_rotation_matrix_xy(0.3, 0.2)
+    for name, path in obj_paths:
+        benchmarks.append((
+            f"Mesh.build_clusters[{name}]",
+            lambda mesh=Mesh.from_obj_file(path): Mesh.build_clusters(Mesh(mesh.vertices, mesh.faces, mesh.normals))
+        ))
+
+        clusters = Mesh.from_obj_file(path).build_clusters()
+        benchmarks.append((
+            f"MeshClusters.visible[{name}]",
+            lambda clusters=clusters: clusters.ranges(clusters.visible(np.array([0.0, 0.0, 7.0]), P @ V, 0.2))
+        ))
+
+    # Calculating the per-draw uniforms.
+    shaders = Shaders("fur", join(RESOURCE_PATH, "shaders/fur/vertex.glsl"),
+                      join(RESOURCE_PATH, "shaders/fur/fragment.glsl"))
+    M = transforms.build_pose_matrix([1.0, 0.0, 0.0], 0.5)
+    benchmarks.append(("Shaders.update_matrices", lambda: shaders.update_matrices(P, V, M)))
+
+    # Matrix builders, both the deprecated allocating versions and the in-place float32 versions which replace them.
+    out = np.empty((4, 4), dtype="f")
+    benchmarks += [
+        ("util.build_translation_matrix", lambda: util.build_translation_matrix([1.0, 2.0, 3.0])),
+        ("util.build_rotation_matrix_xy", lambda: util.build_rotation_matrix_xy(0.3, 0.2)),
+        ("util.build_frustum_matrix", lambda: util.build_frustum_matrix(-1.0, 1.0, 1.0, -1.0, 1.5, 50)),
+        ("util.build_pose_matrix", lambda: util.build_pose_matrix([1.0, 2.0, 3.0], 0.5, [1.0, 2.0, 1.0])),
+        ("util.homogenise", lambda: util.homogenise([1.0, 2.0, 3.0])),
+        ("transforms.build_translation_matrix",
+         lambda: transforms.build_translation_matrix([1.0, 2.0, 3.0], out=out)),
+        ("transforms.build_rotation_matrix_xy", lambda: transforms.build_rotation_matrix_xy(0.3, 0.2, out=out)),
+        ("transforms.build_frustum_matrix",
+         lambda: transforms.build_frustum_matrix(-1.0, 1.0, 1.0, -1.0, 1.5, 50, out=out)),
+        ("transforms.build_pose_matrix",
+         lambda: transforms.build_pose_matrix([1.0, 2.0, 3.0], 0.5, [1.0, 2.0, 1.0], out=out)),
+    ]
+
+    rng = np.random.default_rng(0)
+    for n in BATCH_SIZES:
+        positions = rng.random((n, 3), dtype="f")
+        orientations = rng.random(n, dtype="f")
+        scales = rng.random((n, 3), dtype="f")
+        batch_out = np.empty((n, 4, 4), dtype="f")
+        benchmarks.append((
+            f"transforms.build_pose_matrices[{n}]",
+            lambda p=positions, o=orientations, s=scales, b=batch_out: transforms.build_pose_matrices(p, o, s, out=b)
+        ))
+
+    return benchmarks
+
+
+def run(quick: bool = False, pattern: str = None) -> Dict:
+    """
+    Run all the benchmarks, printing each result as it completes.
+
+    :param quick: only use the smaller synthetic meshes, and take fewer samples
+    :param pattern: only run benchmarks whose name contains this string
+    :return: the results, in the format written to baseline files
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ecm3423-bench-") as tmpdir, warnings.catch_warnings():
+        # The deprecated builders are still measured, for comparison against those replacing them.
+        warnings.simplefilter("ignore", DeprecationWarning)
+        for name, fn in collect(tmpdir, quick):
+            if pattern is not None and pattern not in name:
+                continue
+
+            results[name] = stats = measure(fn, repeat=3 if quick else 5)
+            print(f"{name:<50} {stats['median'] * 1e6:>14.2f} us", flush=True)
+
+    current = {"machine": machine(), "results": results}
+    if pattern is not None:
+        # Recorded so that comparisons know which benchmarks were left out deliberately.
+        current["pattern"] = pattern
+    return current
+
+
+def render(width: int, height: int, quick: bool = False) -> Dict:
+    """
+    Draw the default scene in each fur mode in a hidden window, timing each frame until the GPU has finished drawing
+    it, and printing each mode's throughput relative to blending every layer.
+
+    :param width: the window's width
+    :param height: the window's height
+    :param quick: take fewer samples
+    :return: the results, in the format written to baseline files
+    """
+    pygame.init()
+    pygame.display.set_mode((width, height), pygame.OPENGL | pygame.DOUBLEBUF | pygame.HIDDEN)
+
+    scene = Scene()
+    scene.setup(width, height)
+
+    def draw():
+        scene.draw()
+        glFinish()
+
+    results = {}
+    for mode in FUR_MODES:
+        scene.fur_mode = mode
+        draw()
+
+        name = f"Scene.draw[{mode}, {width}x{height}]"
+        results[name] = stats = measure(draw, repeat=3 if quick else 5, min_time=0.5)
+        speedup = results[f"Scene.draw[{FUR_MODE_BLEND}, {width}x{height}]"]["median"] / stats["median"]
+        print(f"{name:<50} {stats['median'] * 1e3:>11.2f} ms {1 / stats['median']:>8.2f} fps "
+              f"{speedup:>6.2f}x {FUR_MODE_BLEND} fps", flush=True)
+
+    scene.teardown()
+    pygame.quit()
+
+    return {"machine": machine(), "results": results}
+
+
+def machine() -> Dict[str, str]:
+    """
+    Describe the machine the benchmarks are run on, to record alongside their results.
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> bool:
+    """
+    Compare two sets of results, printing the relative change of each benchmark.
+
+    :param baseline: results to compare against
+    :param current: newly measured results
+    :param threshold: largest permitted relative slowdown, e.g. 0.1 for 10%
+    :return: True if no benchmark regressed by more than the threshold, and none in the baseline is missing, unless
+    the current results were filtered to leave it out
+    """
+    ok = True
+    for name, stats in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<50} {'new':>14}")
+            continue
+
+        # Compare the fastest samples, which are least affected by noise from the rest of the system.
+        change = stats["min"] / baseline["results"][name]["min"] - 1.0
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{name:<50} {change * 100:>+13.1f}%{'  REGRESSION' if regressed else ''}")
+
+    pattern = current.get("pattern")
+    for name in baseline["results"]:
+        if name not in current["results"] and (pattern is None or pattern in name):
+            # A benchmark which was renamed, removed or failed to run cannot be checked, so must not pass silently.
+            ok = False
+            print(f"{name:<50} {'MISSING':>14}")
+
+    return ok
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python3 -m ecm3423.benchmark", description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this string")
+    run_parser.add_argument("--quick", action="store_true", help="use smaller meshes and fewer samples")
+
+    render_parser = subparsers.add_parser("render", help="time drawing the scene in each fur mode")
+    render_parser.add_argument("--size", default="1920x1080", help="window size as WIDTHxHEIGHT (default: 1920x1080)")
+    render_parser.add_argument("--quick", action="store_true", help="take fewer samples")
+
+    for subparser in (run_parser, render_parser):
+        subparser.add_argument("-o", "--output", help="write results as JSON to this file")
+        subparser.add_argument("--compare", metavar="BASELINE", help="compare results against this baseline file")
+        subparser.add_argument("--threshold", type=float, default=0.1, help="permitted slowdown (default: 0.1)")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline", help="results to compare against")
+    compare_parser.add_argument("current", help="newly measured results")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="permitted slowdown (default: 0.1)")
+
+    args = parser.parse_args(argv)
+
+    if args.command in ("run", "render"):
+        if args.command == "run":
+            current = run(args.quick, args.pattern)
+        else:
+            width, height = (int(n) for n in args.size.lower().split("x"))
+            current = render(width, height, args.quick)
+        if args.output is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, "w") as fp:
+                json.dump(current, fp, indent=2)
+        if args.compare is None:
+            return 0
+        with open(args.compare, "r") as fp:
+            baseline = json.load(fp)
+    else:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        with open(args.current, "r") as fp:
+            current = json.load(fp)
+
+    print()
+    return 0 if compare(baseline, current, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
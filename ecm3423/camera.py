@@ -1,5 +1,5 @@
 import numpy as np
-from ecm3423.util import build_translation_matrix, build_rotation_matrix_xy
+from ecm3423.transforms import build_translation_matrix, build_rotation_matrix_xy
 
 
 class Camera:
@@ -13,18 +13,53 @@ class Camera:
     distance = 7.0
 
     def __init__(self):
-        self.V = np.identity(4)
+        # Copy the default position, so that each camera moves independently.
+        self.center = list(self.center)
+
+        self.V = np.identity(4, dtype="f")
         self.V[2, 3] = -self.distance
 
+        # Intermediate matrices are updated in place to avoid allocating on every camera movement.
         self.D = build_translation_matrix(self.center)
         self.R = build_rotation_matrix_xy(self.psi, self.phi)
         self.T = build_translation_matrix([0.0, 0.0, -self.distance])
+        self._TR = np.matmul(self.T, self.R)
+
+        # The rotation and position at the start of the current fixed update step, and scratch matrices for
+        # interpolating between them and the current rotation and position.
+        self.previous = (self.psi, self.phi, tuple(self.center))
+        self._R = self.R.copy()
+        self._D = self.D.copy()
+
+        # Set whenever the camera moves, and cleared by whoever redraws the view.
+        self.changed = True
+
+    def step(self):
+        """
+        Start a new fixed update step, remembering the current rotation and position to interpolate from.
+        """
+        current = (self.psi, self.phi, tuple(self.center))
+        if current != self.previous:
+            # The view was drawn part way through the last step's movement, so must be redrawn once it completes.
+            self.changed = True
+        self.previous = current
 
-    def update(self):
+    def update(self, alpha: float = 1.0):
         """
         Apply changes in camera position and rotation to the view matrix.
+
+        :param alpha: how far to place the camera between its state at the start of the current update step (0.0)
+        and its current state (1.0)
         """
-        self.V = np.matmul(np.matmul(self.T, self.R), self.D)
+        psi, phi, center = self.previous
+        if alpha >= 1.0 or (psi, phi, center) == (self.psi, self.phi, tuple(self.center)):
+            R, D = self.R, self.D
+        else:
+            R = build_rotation_matrix_xy(psi + (self.psi - psi) * alpha, phi + (self.phi - phi) * alpha, out=self._R)
+            D = build_translation_matrix([c + (n - c) * alpha for c, n in zip(center, self.center)], out=self._D)
+
+        np.matmul(self.T, R, out=self._TR)
+        np.matmul(self._TR, D, out=self.V)
 
     def rotate(self, psi: float, phi: float):
         """
@@ -33,9 +68,13 @@ class Camera:
         :param psi:
         :param phi:
         """
+        if psi == 0 and phi == 0:
+            return
+
         self.phi += phi
         self.psi += psi
-        self.R = build_rotation_matrix_xy(self.psi, self.phi)
+        self.changed = True
+        build_rotation_matrix_xy(self.psi, self.phi, out=self.R)
 
         self.update()
 
@@ -46,8 +85,12 @@ class Camera:
         :param dx: change in the camera's x coordinate
         :param dy: change in the camera's y coordinate
         """
+        if dx == 0 and dy == 0:
+            return
+
         self.center[0] += dx
         self.center[1] -= dy
-        self.D = build_translation_matrix(self.center)
+        self.changed = True
+        build_translation_matrix(self.center, out=self.D)
 
         self.update()
@@ -0,0 +1,290 @@
+import ctypes
+from typing import Any, Dict, List, Optional, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+from ecm3423.mesh import Mesh, MeshClusters
+from ecm3423.resources import ResourceManager, gpu_resources
+
+# Number of bands of consecutive layers which are each culled against their own normal cones. Extrusion turns faces
+# further the more layers a cone must contain, so narrower bands cull more, at the cost of a draw call per band.
+CULL_BANDS = 2
+
+
+def build_fur_mesh(mesh: Mesh, n_layers: int, length: float) -> Tuple[Mesh, np.array]:
+    """
+    Generate the additional extruded layers required for showing fur on the given mesh. This does not require an
+    OpenGL context.
+
+    :param mesh: the mesh to grow fur on
+    :param n_layers: the number of fur layers to generate
+    :param length: how far the outermost layer is extruded from the mesh
+    :return: the layered fur mesh, and the layer (between 0.0 and 1.0) of each of its vertices
+    """
+    fur_mesh = Mesh(np.tile(mesh.vertices, (n_layers, 1)),
+                    np.tile(mesh.faces, (n_layers, 1)),
+                    np.tile(mesh.normals, (n_layers, 1)))
+
+    orig_n_vertices = mesh.vertices.shape[0]
+    layer_data = np.zeros(orig_n_vertices * n_layers, 'f')
+    orig_n_faces = mesh.faces.shape[0]
+    for i in range(n_layers):
+        layer = i / n_layers
+
+        # Select all the vertices in this layer using this slice. Extrude
+        # each successive layer out from the original model.
+        vertices_slice = slice(i * orig_n_vertices, (i + 1) * orig_n_vertices)
+        layer_data[vertices_slice] = layer
+        fur_mesh.vertices[vertices_slice] += fur_mesh.normals[vertices_slice] * length * layer
+
+        # Select all the faces in this layer, and make sure they point to
+        # the new vertices!
+        fur_mesh.faces[i * orig_n_faces:(i + 1) * orig_n_faces] += orig_n_vertices * i
+
+    return fur_mesh, layer_data
+
+
+class FurBuffers:
+    """
+    The vertex and index buffers of a layered fur mesh. These are shared between every FurModel which uses the same
+    mesh and fur layout, so that each only differs in its own per-model state.
+    """
+
+    def __init__(self, mesh: Mesh, n_layers: int, length: float, resources: ResourceManager = gpu_resources):
+        """
+        Generate the fur mesh for the given mesh and upload it to the GPU.
+
+        :param mesh: the mesh to grow fur on
+        :param n_layers: the number of fur layers to generate
+        :param length: how far the outermost layer is extruded from the mesh
+        :param resources: manager tracking the buffers' GPU memory
+        """
+        # Identifies these buffers in GPU memory reports, so must differ from any other buffers' name.
+        self.name = f"mesh@{id(mesh):x}, {mesh.vertices.shape[0]} vertices x {n_layers} layers, length {length:g}"
+        self.resources = resources
+        self.mesh = mesh
+        self.n_layers = n_layers
+        self.length = length
+        self.ref_count = 0
+
+        self.vbos = {}
+        self.attributes = {}
+        self.sizes = {}
+        self.index_buffer = None
+
+        # Clustering reorders the faces, which depends on the fur layout, so cluster a copy of the mesh rather than
+        # the mesh itself, which may be shared with other layouts. Each band of layers has its own clusters, whose
+        # normal cones contain the faces of every layer in the band.
+        self.bands: List[Tuple[range, MeshClusters]] = []
+        if mesh.faces is not None and mesh.faces.shape[1] == 3:
+            mesh = Mesh(mesh.vertices, mesh.faces, mesh.normals)
+            offsets = length * np.arange(n_layers) / n_layers
+            clusters = mesh.build_clusters(offsets=offsets)
+            bounds = np.linspace(0, n_layers, min(CULL_BANDS, n_layers) + 1).round().astype(int)
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                self.bands.append((range(first, last), clusters.extrude(mesh, offsets[first:last])))
+
+        fur_mesh, layer_data = build_fur_mesh(mesh, n_layers, length)
+
+        # Determine whether we are drawing using indexed vertices, and the type of primitives we will be drawing.
+        self.primitive = GL_TRIANGLES
+        self.n_vertices = fur_mesh.vertices.shape[0]
+        self.n_elements = None
+        if fur_mesh.faces is not None:
+            if fur_mesh.faces.shape[1] == 4:
+                self.primitive = GL_TRIANGLE_STRIP
+            self.n_elements = fur_mesh.faces.flatten().shape[0]
+
+        try:
+            self._add_vbo("position", fur_mesh.vertices)
+            self._add_vbo("normal", fur_mesh.normals)
+            self._add_vbo("layer", layer_data, n=1)
+
+            if fur_mesh.faces is not None:
+                self.index_buffer = self.resources.gen_buffer(self)
+                self.resources.buffer_data(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer, fur_mesh.faces)
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        except Exception:
+            # Delete the buffers uploaded so far, e.g. if the rest would exceed the GPU memory budget, as nothing will
+            # own these buffers to release them.
+            self.resources.release(self)
+            raise
+
+    @property
+    def size(self) -> int:
+        """
+        The number of bytes of GPU memory allocated to these buffers.
+        """
+        return self.resources.bytes_owned(self)
+
+    def _add_vbo(self, name: str, value: Any, n: int = 3):
+        """
+        Upload a new vertex buffer object with the given value.
+
+        :param name: the object's name - must match the name of the input to the vertex shader
+        :param value: array of data which this object will point to
+        :param n: size of each element in the array
+        """
+        self.attributes[name] = len(self.vbos)
+        self.sizes[name] = n
+
+        self.vbos[name] = self.resources.gen_buffer(self)
+        self.resources.buffer_data(GL_ARRAY_BUFFER, self.vbos[name], value)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def bind(self):
+        """
+        Point the currently bound vertex array object's attributes at these buffers.
+        """
+        for name, vbo in self.vbos.items():
+            attrib = self.attributes[name]
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glEnableVertexAttribArray(attrib)
+            glVertexAttribPointer(attrib, self.sizes[name], GL_FLOAT, False, 0, None)
+
+        if self.index_buffer is not None:
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+
+    def visible_ranges(self, eye: np.array, PVM: np.array, expand: float = 0.0) \
+            -> Optional[List[Tuple[range, Tuple[np.array, np.array]]]]:
+        """
+        Determine which ranges of faces of the original mesh may be visible within each band of layers.
+
+        :param eye: position of the camera in model space
+        :param PVM: combined projection, view and model matrix
+        :param expand: distance by which the layers may be displaced from the mesh, e.g. by gravity
+        :return: the layers of each band, with the first face and number of faces in each range visible within them,
+        or None if the mesh has no clusters and every face should be drawn
+        """
+        if not self.bands:
+            return None
+
+        return [(band, clusters.ranges(clusters.visible(eye, PVM, expand))) for band, clusters in self.bands]
+
+    def draw_layers(self, layers: range, ranges: Optional[List[Tuple[range, Tuple[np.array, np.array]]]] = None,
+                    instances: Optional[int] = None):
+        """
+        Draw the given layers of the fur mesh. Each layer's primitives are stored contiguously, so layers drawn in
+        increasing order are issued as a single draw call, whereas any other order requires one call per layer.
+
+        :param layers: the layers to draw, in the order they should be drawn, e.g. range(n_layers - 1, 0, -1)
+        :param ranges: optionally, only draw these ranges of faces of the original mesh within each band of layers, as
+        returned by visible_ranges()
+        :param instances: optionally, draw this many instances of each layer, in which case ranges are ignored
+        """
+        if len(layers) == 0:
+            return
+
+        if ranges is not None and self.n_elements is not None and instances is None:
+            # Draw each band's part of the given layers in turn, keeping the layers in the order given.
+            for band, (starts, counts) in ranges if layers.step > 0 else reversed(ranges):
+                in_band = [layer for layer in layers if layer in band]
+                if in_band:
+                    self._draw_face_ranges(range(in_band[0], in_band[-1] + layers.step, layers.step), starts, counts)
+        elif layers.step == 1:
+            self._draw_range(layers.start, len(layers), instances)
+        else:
+            for layer in layers:
+                self._draw_range(layer, 1, instances)
+
+    def _draw_face_ranges(self, layers: range, starts: np.array, counts: np.array):
+        """
+        Draw the same ranges of faces within each of the given layers, in a single draw call.
+
+        :param layers: the layers to draw, in order
+        :param starts: the first face of each range within a layer
+        :param counts: the number of faces in each range
+        """
+        if starts.shape[0] == 0:
+            return
+
+        per_layer = self.n_elements // self.n_layers
+        vertices_per_face = per_layer // self.mesh.faces.shape[0]
+
+        first = np.array(layers)[:, None] * per_layer + starts[None, :] * vertices_per_face
+        offsets = (first * ctypes.sizeof(ctypes.c_uint32)).astype(np.uintp).ravel()
+        n = np.tile(counts * vertices_per_face, len(layers)).astype("i")
+
+        glMultiDrawElements(self.primitive, n, GL_UNSIGNED_INT, offsets, n.shape[0])
+
+    def _draw_range(self, first_layer: int, n_layers: int, instances: Optional[int] = None):
+        """
+        Draw a contiguous range of layers of the fur mesh.
+
+        :param first_layer: the first layer to draw
+        :param n_layers: the number of layers to draw
+        :param instances: optionally, the number of instances to draw
+        """
+        if self.n_elements is not None:
+            per_layer = self.n_elements // self.n_layers
+            offset = ctypes.c_void_p(first_layer * per_layer * ctypes.sizeof(ctypes.c_uint32))
+            if instances is None:
+                glDrawElements(self.primitive, per_layer * n_layers, GL_UNSIGNED_INT, offset)
+            else:
+                glDrawElementsInstanced(self.primitive, per_layer * n_layers, GL_UNSIGNED_INT, offset, instances)
+        else:
+            per_layer = self.n_vertices // self.n_layers
+            if instances is None:
+                glDrawArrays(self.primitive, first_layer * per_layer, per_layer * n_layers)
+            else:
+                glDrawArraysInstanced(self.primitive, first_layer * per_layer, per_layer * n_layers, instances)
+
+    def delete(self):
+        """
+        Delete these buffers from the GPU.
+        """
+        self.resources.release(self)
+
+        self.vbos = {}
+        self.index_buffer = None
+
+
+class FurBufferCache:
+    """
+    A reference-counted cache of FurBuffers, keyed by mesh identity and fur layout.
+    """
+
+    def __init__(self, resources: ResourceManager = gpu_resources):
+        """
+        Initialise a new, empty FurBufferCache.
+
+        :param resources: manager tracking the cached buffers' GPU memory
+        """
+        self.resources = resources
+        self.entries: Dict[Tuple[int, int, float], FurBuffers] = {}
+
+    @staticmethod
+    def _key(mesh: Mesh, n_layers: int, length: float) -> Tuple[int, int, float]:
+        # Each entry holds a reference to its mesh, so the mesh's id cannot be reused whilst the entry exists.
+        return id(mesh), n_layers, float(length)
+
+    def acquire(self, mesh: Mesh, n_layers: int, length: float) -> FurBuffers:
+        """
+        Retrieve the buffers for the given mesh and fur layout, uploading them if they are not already cached.
+        Every call must be matched by a call to release().
+
+        :param mesh: the mesh to grow fur on
+        :param n_layers: the number of fur layers
+        :param length: how far the outermost layer is extruded from the mesh
+        """
+        key = self._key(mesh, n_layers, length)
+        buffers = self.entries.get(key)
+        if buffers is None:
+            buffers = self.entries[key] = FurBuffers(mesh, n_layers, length, self.resources)
+
+        buffers.ref_count += 1
+        return buffers
+
+    def release(self, buffers: FurBuffers):
+        """
+        Release a reference to the given buffers, deleting them from the GPU once they are no longer used.
+
+        :param buffers: buffers previously returned by acquire()
+        """
+        buffers.ref_count -= 1
+        if buffers.ref_count > 0:
+            return
+
+        del self.entries[self._key(buffers.mesh, buffers.n_layers, buffers.length)]
+        buffers.delete()
@@ -1,18 +1,47 @@
-from typing import Any
+from typing import List, Optional, Tuple
 
 from OpenGL.GL import *
 import numpy as np
 
+from ecm3423.fur_buffers import FurBufferCache
 from ecm3423.mesh import Mesh
+from ecm3423.resources import gpu_resources
 from ecm3423.shaders import Shaders
-from ecm3423.util import build_pose_matrix, build_rotation_matrix_xy, unhomogenise
+from ecm3423.transforms import build_pose_matrix, build_rotation_matrix_xy, unhomogenise
 
 NOISE_SIZE = 512
 
+# Fur rendering modes, trading image quality against overdraw.
+# Every layer of each model is alpha-blended in turn, from the base outwards.
+FUR_MODE_BLEND = "blend"
+# The opaque base layers of every model are drawn first to fill the depth buffer, then the shells are blended over
+# them.
+FUR_MODE_PREPASS = "prepass"
+# As above, but the shells are alpha-tested without blending and drawn from the outermost layer inwards, so the depth
+# test rejects fur hidden behind fur already drawn.
+FUR_MODE_ALPHA_TEST = "alpha_test"
+FUR_MODES = [FUR_MODE_BLEND, FUR_MODE_PREPASS, FUR_MODE_ALPHA_TEST]
+
+# Minimum fur alpha below which shell fragments are discarded in each mode. Only modes with a threshold above 0.0 use
+# the shaders' ALPHA_TEST variant, as any program which may discard fragments defeats early depth testing.
+ALPHA_THRESHOLDS = {
+    FUR_MODE_BLEND: 0.0,
+    FUR_MODE_PREPASS: 0.0,
+    FUR_MODE_ALPHA_TEST: 0.2,
+}
+
 
 class FurModel:
+    # Fur mesh buffers shared between all models with the same mesh and fur layout.
+    buffer_cache = FurBufferCache(gpu_resources)
+    resources = gpu_resources
+
+    # Whether to skip drawing clusters of faces which are backfacing or outside the view frustum.
+    cull_clusters = True
+
     def __init__(self, mesh: Mesh, shaders: Shaders, M: np.array = build_pose_matrix(), n_layers: int = 25,
-                 density: float = 5.0, length: float = 0.1, gravity: np.array = np.array([-0.5, -1., 0.])):
+                 density: float = 5.0, length: float = 0.1, gravity: np.array = np.array([-0.5, -1., 0.]),
+                 name: Optional[str] = None):
         """
         Initialise a new FurModel.
 
@@ -23,18 +52,15 @@ class FurModel:
         :param density: how dense the fur appears - the larger the number, the more clumps of fur
         :param length: how long the fur hairs appear as
         :param gravity: normalised direction for the individual fur hairs to point in away from the model's faces
+        :param name: optional name identifying this model in GPU memory reports
         """
+        self.name = name
         self.M = M
-        self.vao = glGenVertexArrays(1)
-        self.vbos = {}
+        self.vao = self.resources.gen_vertex_array(self)
         self.attributes = {}
-        self.index_buffer = None
 
-        # Populated within set_mesh, information required for OpenGL to draw our mesh.
-        self.primitive = None
-        self.n_vertices = 0
-        self.n_elements = 0
-        self.layer_data = None
+        # Populated within set_mesh, the (possibly shared) buffers required for OpenGL to draw our mesh.
+        self.buffers = None
 
         # Fur properties.
         self.n_layers = n_layers
@@ -42,96 +68,45 @@ class FurModel:
         self.length = length
         self.gravity = gravity
 
+        # Set whenever a fur property changes, and cleared by whoever redraws the model.
+        self.changed = True
+
+        # The ranges of faces visible in the most recently drawn view, and what they were determined from, so that
+        # each pass drawing the same frame does not determine them again.
+        self.visible_cache = None
+
         # Fur texture. Repeated over each layer to give the illusion of fur.
-        self.texture = glGenTextures(1)
+        self.texture = self.resources.gen_texture(self)
         self.texture_data = np.random.randint(2, size=(NOISE_SIZE, NOISE_SIZE))
 
         self.set_mesh(mesh)
         self.set_shaders(shaders)
 
-    def _add_vbo(self, name: str, value: Any, n: int = 3):
-        """
-        Add a new vertex buffer object with the given value to the shader.
-
-        :param name: the object's name - must match the name of the input to the vertex shader
-        :param value: array of data which this object will point to
-        :param n: size of each element in the array
-        """
-        self.attributes[name] = attrib = len(self.vbos)
-
-        self.vbos[name] = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[name])
-
-        glEnableVertexAttribArray(attrib)
-        glVertexAttribPointer(attrib, n, GL_FLOAT, False, 0, None)
-        glBufferData(GL_ARRAY_BUFFER, value, GL_STATIC_DRAW)
-
     def _bind(self):
         """
-        Bind the the model to the shader's inputs.
+        Bind the the model's buffers to the shader's inputs.
         """
         glBindVertexArray(self.vao)
-
-        self._add_vbo("position", self.fur_mesh.vertices)
-        self._add_vbo("normal", self.fur_mesh.normals)
-        self._add_vbo("layer", self.layer_data, n=1)
-
-        # Determine whether we are drawing using indexed vertices, and the type of primitives we will be drawing.
-        if self.fur_mesh.faces is None:
-            if self.index_buffer is not None:
-                glDeleteBuffers(1, self.index_buffer)
-                self.index_buffer = None
-            self.n_elements = None
-        else:
-            if self.fur_mesh.faces.shape[1] == 4:
-                self.primitive = GL_TRIANGLE_STRIP
-            if self.index_buffer is None:
-                self.index_buffer = glGenBuffers(1)
-            self.n_elements = self.fur_mesh.faces.flatten().shape[0]
-
-            # If we're drawing indexed vertices, we need to bind an index buffer.
-            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
-            glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.fur_mesh.faces, GL_STATIC_DRAW)
-
+        self.buffers.bind()
         glBindVertexArray(0)
 
-    def build_fur_mesh(self):
-        """
-        Generate the additional extruded layers required for showing fur on the rendered model.
-        """
-        self.fur_mesh = Mesh(np.tile(self.mesh.vertices, (self.n_layers, 1)),
-                             np.tile(self.mesh.faces, (self.n_layers, 1)),
-                             np.tile(self.mesh.normals, (self.n_layers, 1)))
-
-        orig_n_vertices = self.mesh.vertices.shape[0]
-        self.layer_data = np.zeros(orig_n_vertices * self.n_layers, 'f')
-        orig_n_faces = self.mesh.faces.shape[0]
-        for i in range(self.n_layers):
-            layer = i / self.n_layers
-
-            # Select all the vertices in this layer using this slice. Extrude
-            # each successive layer out from the original model.
-            vertices_slice = slice(i * orig_n_vertices, (i + 1) * orig_n_vertices)
-            self.layer_data[vertices_slice] = layer
-            self.fur_mesh.vertices[vertices_slice] += self.fur_mesh.normals[vertices_slice] * self.length * layer
-
-            # Select all the faces in this layer, and make sure they point to
-            # the new vertices!
-            self.fur_mesh.faces[i * orig_n_faces:(i + 1) * orig_n_faces] += orig_n_vertices * i
-
     def set_mesh(self, mesh: Mesh):
         """
-        Set this model's mesh.
+        Set this model's mesh, sharing its fur buffers with any other model using the same mesh and fur layout.
 
         :param mesh: the model's new mesh
         """
-        self.mesh = mesh
-        self.primitive = GL_TRIANGLES
-        self.build_fur_mesh()
+        old_buffers = self.buffers
 
-        self.n_vertices = self.fur_mesh.vertices.shape[0]
+        self.mesh = mesh
+        self.buffers = self.buffer_cache.acquire(mesh, self.n_layers, self.length)
+        self.attributes = self.buffers.attributes
         self._bind()
 
+        # Release the old buffers after acquiring the new ones, so they are not re-uploaded if they are the same.
+        if old_buffers is not None:
+            self.buffer_cache.release(old_buffers)
+
     def set_shaders(self, shaders: Shaders):
         """
         Set this model's shaders and passes the texture to OpenGL for use within the shader.
@@ -139,9 +114,12 @@ class FurModel:
         :param shaders: the model's new shaders
         """
         self.shaders = shaders
-        self.shaders.add_uniform("density", self.density)
-        self.shaders.add_uniform("gravity", self.gravity)
-        self.shaders.link(self.attributes)
+        self.alpha_test_shaders = shaders.variant("ALPHA_TEST")
+        self.alpha_test_shaders.add_uniform("alpha_threshold", 0.0)
+        for program in (self.shaders, self.alpha_test_shaders):
+            program.add_uniform("density", self.density)
+            program.add_uniform("gravity", self.gravity)
+            program.link(self.attributes)
 
         glBindTexture(GL_TEXTURE_2D, self.texture)
 
@@ -150,7 +128,7 @@ class FurModel:
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
 
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RED, NOISE_SIZE, NOISE_SIZE, 0, GL_RED, GL_FLOAT, self.texture_data)
+        self.resources.tex_image_2d(self.texture, GL_RED, NOISE_SIZE, NOISE_SIZE, GL_RED, GL_FLOAT, self.texture_data)
 
     def set_density(self, density: float):
         """
@@ -158,8 +136,9 @@ class FurModel:
 
         :param density: new value of density for the fur
         """
-        if density > 0.0:
+        if density > 0.0 and density != self.density:
             self.density = density
+            self.changed = True
 
     def set_length(self, length: float):
         """
@@ -167,8 +146,9 @@ class FurModel:
 
         :param length: new value of fur length
         """
-        if length > 0.0:
+        if length > 0.0 and length != self.length:
             self.length = length
+            self.changed = True
 
     def set_direction(self, psi: float, phi: float):
         """
@@ -178,31 +158,123 @@ class FurModel:
         :param phi:
         """
         self.gravity = unhomogenise(np.matmul(np.array([1.0, 1.0, 1.0, 1.0], "f"), build_rotation_matrix_xy(psi, phi)))
+        self.changed = True
 
-    def draw(self, P: np.array, V: np.array):
+    def _use(self, P: np.array, V: np.array, alpha_threshold: float):
         """
-        Draw the mesh to the scene.
+        Bind this model's vertex array, shaders, uniforms and texture ready for drawing.
 
         :param P: projection matrix
         :param V: view matrix
+        :param alpha_threshold: fur alpha below which fragments are discarded, or 0.0 to use the shaders which never
+        discard fragments
         """
         glBindVertexArray(self.vao)
-        self.shaders.use(P, V, self.M)
 
-        self.shaders.set_uniform("density", self.density)
-        self.shaders.set_uniform("gravity", self.gravity * self.length)
+        if alpha_threshold > 0.0:
+            shaders = self.alpha_test_shaders
+            shaders.set_uniform("alpha_threshold", alpha_threshold)
+        else:
+            shaders = self.shaders
+
+        shaders.set_uniform("density", self.density)
+        shaders.set_uniform("gravity", self.gravity * self.length)
+        shaders.use(P, V, self.M)
 
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, self.texture)
 
-        if self.n_elements is not None:
-            glDrawElements(self.primitive, self.n_elements, GL_UNSIGNED_INT, None)
-        else:
-            glDrawArrays(self.primitive, 0, self.n_vertices)
+    def _visible_ranges(self, P: np.array, V: np.array) -> Optional[List[Tuple[range, Tuple[np.array, np.array]]]]:
+        """
+        Determine which ranges of the mesh's faces may be visible from the camera within each band of layers.
+
+        :param P: projection matrix
+        :param V: view matrix
+        :return: the ranges visible within each band, as from FurBuffers.visible_ranges(), or None if every face
+        should be drawn
+        """
+        if not self.cull_clusters or not self.buffers.bands:
+            return None
+
+        # Fur layers are extruded along the normals by up to the length they were built with, then shifted by gravity.
+        expand = self.buffers.length + np.linalg.norm(self.gravity) * self.length
 
+        key = (P.tobytes(), V.tobytes(), self.M.tobytes(), expand, self.buffers)
+        if self.visible_cache is None or self.visible_cache[0] != key:
+            VM = np.matmul(V, self.M)
+            eye = np.linalg.inv(VM)[:3, 3]
+            self.visible_cache = (key, self.buffers.visible_ranges(eye, np.matmul(P, VM), expand))
+
+        return self.visible_cache[1]
+
+    def _draw_layers(self, layers: range, ranges: Optional[List[Tuple[range, Tuple[np.array, np.array]]]]):
+        """
+        Draw the given layers of the model's fur mesh, which must already be bound with _use().
+
+        :param layers: the layers to draw, in order
+        :param ranges: the ranges of faces to draw within each band of layers, or None for every face
+        """
+        self.buffers.draw_layers(layers, ranges)
+
+    def draw(self, P: np.array, V: np.array):
+        """
+        Draw the mesh to the scene.
+
+        :param P: projection matrix
+        :param V: view matrix
+        """
+        self._use(P, V, ALPHA_THRESHOLDS[FUR_MODE_BLEND])
+        self._draw_layers(range(self.n_layers), self._visible_ranges(P, V))
         glBindVertexArray(0)
 
+    def draw_base(self, P: np.array, V: np.array):
+        """
+        Draw only the opaque base layer of the mesh to the scene.
+
+        :param P: projection matrix
+        :param V: view matrix
+        """
+        self._use(P, V, 0.0)
+        self._draw_layers(range(1), self._visible_ranges(P, V))
+        glBindVertexArray(0)
+
+    def draw_shells(self, P: np.array, V: np.array, mode: str = FUR_MODE_PREPASS):
+        """
+        Draw only the fur shells of the mesh to the scene, in the order required by the given mode.
+
+        :param P: projection matrix
+        :param V: view matrix
+        :param mode: one of FUR_MODES
+        """
+        self._use(P, V, ALPHA_THRESHOLDS[mode])
+        ranges = self._visible_ranges(P, V)
+        if mode == FUR_MODE_ALPHA_TEST:
+            # Without blending the order does not affect the result, so draw front to back.
+            self._draw_layers(range(self.n_layers - 1, 0, -1), ranges)
+        else:
+            self._draw_layers(range(1, self.n_layers), ranges)
+        glBindVertexArray(0)
+
+    def gpu_bytes(self, include_shared: bool = True) -> int:
+        """
+        Retrieve the number of bytes of GPU memory allocated for this model.
+
+        :param include_shared: whether to include the fur mesh buffers, which may be shared with other models
+        """
+        size = self.resources.bytes_owned(self)
+        if include_shared and self.buffers is not None:
+            size += self.buffers.size
+        return size
+
+    def release(self):
+        """
+        Delete this model's OpenGL objects, and release its reference to its fur mesh buffers. The model cannot be
+        drawn afterwards.
+        """
+        if self.buffers is not None:
+            self.buffer_cache.release(self.buffers)
+            self.buffers = None
+        self.resources.release(self)
+
     def __del__(self):
-        vbos_values = list(self.vbos.values())
-        glDeleteBuffers(len(vbos_values), np.array(vbos_values))
-        glDeleteVertexArrays(1, np.array([self.vao]))
+        self.release()
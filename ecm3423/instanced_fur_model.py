@@ -0,0 +1,206 @@
+import ctypes
+from typing import List, Optional, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+from ecm3423.fur_model import FurModel
+from ecm3423.mesh import Mesh
+from ecm3423.shaders import Shaders
+from ecm3423.transforms import build_pose_matrices
+
+# Layout of each instance's parameters within the instance buffer, as (offset, rows, columns) in floats. Matrices are
+# stored transposed, so that each group of rows floats is one column of the matrix as GLSL expects.
+INSTANCE_ATTRIBUTES = {
+    "instance_M": (0, 4, 4),
+    "instance_MiT": (16, 3, 3),
+    "instance_color": (25, 3, 1),
+    "instance_fur": (28, 2, 1),
+}
+INSTANCE_SIZE = 30
+
+
+def _supports_instanced_arrays() -> bool:
+    """
+    Whether the current context supports per-instance vertex attributes, which are core from OpenGL 3.3 and otherwise
+    need the ARB_instanced_arrays extension.
+    """
+    if (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION)) >= (3, 3):
+        return True
+
+    extensions = (glGetStringi(GL_EXTENSIONS, i) for i in range(glGetIntegerv(GL_NUM_EXTENSIONS)))
+    return b"GL_ARB_instanced_arrays" in extensions
+
+
+class InstancedFurModel(FurModel):
+    """
+    Many instances of a furry mesh, drawn with a single draw call per pass. Each instance has its own pose matrix,
+    colour, and fur density and length, stored together in one buffer on the GPU.
+    """
+
+    # Clusters cannot be culled for all instances at once.
+    cull_clusters = False
+
+    def __init__(self, mesh: Mesh, shaders: Shaders, n_instances: int, n_layers: int = 25, density: float = 5.0,
+                 length: float = 0.1, gravity: np.array = np.array([-0.5, -1., 0.]), name: Optional[str] = None):
+        """
+        Initialise a new InstancedFurModel. Every instance starts at the origin, with the default colour and fur.
+
+        :param mesh: the mesh drawn for every instance
+        :param shaders: instanced shaders to draw with, e.g. ShaderStore.get("fur_instanced")
+        :param n_instances: the number of instances
+        :param n_layers: the number of fur layers that are to be rendered to show fur
+        :param density: how dense the fur appears, which each instance's density multiplies
+        :param length: how long the fur hairs appear as, which each instance's length multiplies
+        :param gravity: normalised direction for the individual fur hairs to point in away from the model's faces
+        :param name: optional name identifying this model in GPU memory reports
+        """
+        self.n_instances = n_instances
+        self.instance_data = np.zeros((n_instances, INSTANCE_SIZE), "f")
+        self.instance_buffer = None
+
+        # The range of instances which have changed since the instance buffer was last uploaded.
+        self.dirty = None
+
+        self.set_poses(np.broadcast_to(np.identity(4, "f"), (n_instances, 4, 4)))
+        self.set_colors(np.broadcast_to(shaders.color, (n_instances, 3)))
+        self.set_fur(np.ones(n_instances, "f"), np.ones(n_instances, "f"))
+
+        super().__init__(mesh, shaders, M=np.identity(4, "f"), n_layers=n_layers, density=density, length=length,
+                         gravity=gravity, name=name)
+
+    def _bind(self):
+        """
+        Bind the model's buffers, and the per-instance attributes, to the shader's inputs.
+        """
+        if not _supports_instanced_arrays():
+            raise RuntimeError(
+                "Unable to bind per-instance attributes, which need OpenGL 3.3 or ARB_instanced_arrays: the current "
+                f"context is OpenGL {glGetString(GL_VERSION).decode('utf-8')}"
+            )
+
+        glBindVertexArray(self.vao)
+        self.buffers.bind()
+
+        if self.instance_buffer is None:
+            self.instance_buffer = self.resources.gen_buffer(self)
+            self.resources.buffer_data(GL_ARRAY_BUFFER, self.instance_buffer, self.instance_data, GL_DYNAMIC_DRAW)
+            self.dirty = None
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+
+        # Per-instance attributes follow the mesh's attributes. Each matrix takes up one attribute per column.
+        self.attributes = dict(self.buffers.attributes)
+        attrib = len(self.attributes)
+        stride = INSTANCE_SIZE * ctypes.sizeof(ctypes.c_float)
+        for name, (offset, rows, columns) in INSTANCE_ATTRIBUTES.items():
+            self.attributes[name] = attrib
+            for column in range(columns):
+                glEnableVertexAttribArray(attrib)
+                glVertexAttribPointer(attrib, rows, GL_FLOAT, False, stride,
+                                      ctypes.c_void_p((offset + column * rows) * ctypes.sizeof(ctypes.c_float)))
+                glVertexAttribDivisor(attrib, 1)
+                attrib += 1
+
+        glBindVertexArray(0)
+
+    def _mark_dirty(self, start: int, stop: int):
+        """
+        Record that the given range of instances has changed, and must be uploaded before the next draw.
+
+        :param start: the first changed instance
+        :param stop: one past the last changed instance
+        """
+        if self.dirty is None:
+            self.dirty = (start, stop)
+        else:
+            self.dirty = (min(self.dirty[0], start), max(self.dirty[1], stop))
+
+        self.changed = True
+
+    def _upload(self):
+        """
+        Upload only the range of instances which have changed since the last upload.
+        """
+        if self.dirty is None:
+            return
+
+        start, stop = self.dirty
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, start * self.instance_data.itemsize * INSTANCE_SIZE,
+                        self.instance_data[start:stop])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.dirty = None
+
+    def _set(self, attribute: str, values: np.array, start: int):
+        """
+        Set one attribute of a contiguous range of instances.
+
+        :param attribute: name of the attribute in INSTANCE_ATTRIBUTES
+        :param values: array with one row of the attribute's values per instance
+        :param start: the first instance to set
+        """
+        offset, rows, columns = INSTANCE_ATTRIBUTES[attribute]
+        size = rows * columns
+        values = np.asarray(values, "f").reshape(-1, size)
+        stop = start + values.shape[0]
+        if start < 0 or stop > self.n_instances:
+            raise IndexError(f"Unable to set instances {start} to {stop}: there are only {self.n_instances}")
+
+        self.instance_data[start:stop, offset:offset + size] = values
+        self._mark_dirty(start, stop)
+
+    def set_poses(self, M: np.array, start: int = 0):
+        """
+        Set the pose matrices of a contiguous range of instances, along with the matrices which transform their
+        normals.
+
+        :param M: (N, 4, 4) array of invertible pose matrices
+        :param start: the first instance to set
+        """
+        self._set("instance_M", np.transpose(M, (0, 2, 1)), start)
+        # The inverse transpose of each pose's upper 3x3, stored transposed, which is just the inverse.
+        self._set("instance_MiT", np.linalg.inv(np.asarray(M, "f")[:, :3, :3]), start)
+
+    def set_pose_components(self, positions: np.array, orientations: Optional[np.array] = None,
+                            scales: Optional[np.array] = None, start: int = 0):
+        """
+        Set the poses of a contiguous range of instances from their positions, orientations and scales.
+
+        :param positions: (N, 3) array of positions
+        :param orientations: optional (N,) array of rotations about the z axis in radians
+        :param scales: optional (N, 3) array of per-axis scales, or (N,) array of uniform scales
+        :param start: the first instance to set
+        """
+        self.set_poses(build_pose_matrices(positions, orientations, scales), start)
+
+    def set_colors(self, colors: np.array, start: int = 0):
+        """
+        Set the colours of a contiguous range of instances.
+
+        :param colors: (N, 3) array of RGB colours
+        :param start: the first instance to set
+        """
+        self._set("instance_color", colors, start)
+
+    def set_fur(self, density: np.array, length: np.array, start: int = 0):
+        """
+        Set the fur of a contiguous range of instances, relative to the model's density and length.
+
+        :param density: (N,) array of fur density multipliers
+        :param length: (N,) array of fur length multipliers
+        :param start: the first instance to set
+        """
+        self._set("instance_fur", np.stack((density, length), axis=-1), start)
+
+    def _use(self, P: np.array, V: np.array, alpha_threshold: float):
+        self._upload()
+        super()._use(P, V, alpha_threshold)
+
+    def _draw_layers(self, layers: range, ranges: Optional[List[Tuple[range, Tuple[np.array, np.array]]]]):
+        if layers.step < 0:
+            # Layers are only drawn outermost first when alpha-tested without blending, where the order only affects
+            # how many fragments the depth test rejects early, not the image. Drawing them in increasing order instead
+            # keeps every instance of every layer to a single draw call.
+            layers = layers[::-1]
+        self.buffers.draw_layers(layers, instances=self.n_instances)
@@ -1,6 +1,107 @@
-from typing import Optional
+from typing import Optional, Tuple
 import numpy as np
 
+# Default maximum number of faces in each cluster.
+CLUSTER_SIZE = 64
+# Faces are grouped by normal direction into the cells of an n x n grid on each face of a cube before clustering.
+NORMAL_GRID_SIZE = 4
+# Faces whose normal turns further than this from its original direction, given as a cosine, once the mesh is extruded
+# are clustered apart from the rest.
+TURN_LIMIT = 0.85
+
+
+class MeshClusters:
+    """
+    Bounds of small clusters of a mesh's faces, each stored contiguously within the mesh's faces, which allow whole
+    clusters to be culled when they face away from the camera or lie outside the view frustum.
+    """
+
+    def __init__(self, starts: np.array, counts: np.array, centers: np.array, radii: np.array, axes: np.array,
+                 cutoffs: np.array):
+        """
+        Initialise a new set of clusters.
+
+        :param starts: index of the first face in each cluster
+        :param counts: number of faces in each cluster
+        :param centers: (N, 3) array of bounding sphere centers
+        :param radii: bounding sphere radii
+        :param axes: (N, 3) array of normal cone axes
+        :param cutoffs: normal cone cutoffs, the sine of each cone's half-angle, or infinity if a cluster's normals
+        span a hemisphere or more and so it can never be entirely backfacing
+        """
+        self.starts = starts
+        self.counts = counts
+        self.centers = centers
+        self.radii = radii
+        self.axes = axes
+        self.cutoffs = cutoffs
+
+    def __len__(self) -> int:
+        return self.starts.shape[0]
+
+    def visible(self, eye: np.array, PVM: np.array, expand: float = 0.0) -> np.array:
+        """
+        Determine which clusters may be visible.
+
+        :param eye: camera position in model space
+        :param PVM: projection-view-model matrix
+        :param expand: distance to grow each cluster's bounding sphere by, to account for displaced vertices
+        :return: boolean array, False for each cluster which is certainly backfacing or outside the view frustum
+        """
+        radii = self.radii + expand
+
+        # A cluster is backfacing if every point in its bounding sphere sees every normal in its cone from behind.
+        view = self.centers - eye
+        distance = np.linalg.norm(view, axis=1)
+        with np.errstate(invalid="ignore"):
+            backfacing = np.einsum("ij,ij->i", view, self.axes) >= self.cutoffs * distance + radii
+
+        # Extract the frustum's planes in model space from the projection-view-model matrix.
+        planes = np.concatenate((PVM[3] + PVM[:3], PVM[3] - PVM[:3]))
+        planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+        outside = np.any(self.centers @ planes[:, :3].T + planes[:, 3] < -radii[:, None], axis=1)
+
+        return ~(backfacing | outside)
+
+    def ranges(self, visible: np.array) -> Tuple[np.array, np.array]:
+        """
+        Merge runs of adjacent visible clusters into contiguous ranges of faces.
+
+        :param visible: boolean array of visible clusters, as returned by visible()
+        :return: the first face and number of faces in each range
+        """
+        # Find where runs of visible clusters begin and end.
+        edges = np.diff(np.concatenate(([0], visible.astype("i"), [0])))
+        first = np.flatnonzero(edges == 1)
+        last = np.flatnonzero(edges == -1) - 1
+
+        starts = self.starts[first]
+        return starts, self.starts[last] + self.counts[last] - starts
+
+    def extrude(self, mesh: "Mesh", offsets: np.array) -> "MeshClusters":
+        """
+        Widen each cluster's normal cone to contain the normals of its faces in every shell of the given mesh, with
+        the vertices of each shell extruded along their normals by the corresponding offset. As the vertex normals
+        differ across each face, extrusion turns the faces, so the base mesh's cones alone could cull visible shells.
+
+        Gravity shifts each whole shell without turning its faces, so is instead accounted for by the bounding
+        spheres being expanded in visible().
+
+        :param mesh: the mesh these clusters were built from, by Mesh.build_clusters()
+        :param offsets: distance each shell is extruded by, e.g. length * layer for each layer of fur
+        :return: new clusters with the same faces and bounding spheres, but widened normal cones
+        """
+        cluster = np.repeat(np.arange(len(self)), self.counts)
+        axes = self.axes[cluster]
+
+        min_dots = None
+        for offset in offsets:
+            face_normals, valid = _face_normals((mesh.vertices + mesh.normals * offset)[mesh.faces[:, :3]])
+            dots = np.minimum.reduceat(np.where(valid, np.einsum("ij,ij->i", face_normals, axes), 1.0), self.starts)
+            min_dots = dots if min_dots is None else np.minimum(min_dots, dots)
+
+        return MeshClusters(self.starts, self.counts, self.centers, self.radii, self.axes, _cone_cutoffs(min_dots))
+
 
 class Mesh:
     """
@@ -12,6 +113,8 @@ class Mesh:
     ):
         self.vertices = vertices
         self.faces = faces
+        self.clusters = None
+        self.cluster_args = None
 
         if normals is None:
             self._calculate_normals()
@@ -32,6 +135,83 @@ class Mesh:
 
         self.normals /= np.linalg.norm(self.normals, axis=1, keepdims=True)
 
+    def build_clusters(self, max_faces: int = CLUSTER_SIZE,
+                       offsets: Optional[np.array] = None) -> MeshClusters:
+        """
+        Split this mesh's faces into clusters of nearby faces pointing in similar directions, reordering the faces so
+        that each cluster is contiguous. Clusters are only built once; later calls with the same arguments return the
+        existing clusters.
+
+        :param max_faces: maximum number of faces in each cluster
+        :param offsets: optionally, the distances the mesh will be extruded by along its normals, e.g. for each layer
+        of fur, so that faces which turn sharply once extruded can be clustered apart from the rest
+        :raises ValueError: if clusters have already been built with different arguments, as the faces are already
+        ordered for those clusters
+        """
+        if self.clusters is not None:
+            built_max_faces, built_offsets = self.cluster_args
+            if max_faces != built_max_faces or (offsets is None) != (built_offsets is None) or (
+                    offsets is not None and not np.array_equal(offsets, built_offsets)):
+                raise ValueError("clusters have already been built for this mesh with different arguments")
+            return self.clusters
+
+        corners = self.vertices[self.faces[:, :3]]
+        face_normals, valid = _face_normals(corners)
+
+        # Bucket faces by where their normal meets a cube, so that faces in each cluster point in similar directions,
+        # then order each bucket along a Z-order curve so nearby faces are grouped together.
+        rows = np.arange(face_normals.shape[0])
+        axis = np.argmax(np.abs(face_normals), axis=1)
+        major = face_normals[rows, axis]
+        bucket = axis * 2 + (major < 0)
+        for minor_axis in ((axis + 1) % 3, (axis + 2) % 3):
+            minor = np.divide(face_normals[rows, minor_axis], np.abs(major), out=np.zeros_like(major),
+                              where=major != 0)
+            cell = np.clip(((minor + 1) / 2 * NORMAL_GRID_SIZE).astype("i"), 0, NORMAL_GRID_SIZE - 1)
+            bucket = bucket * NORMAL_GRID_SIZE + cell
+
+        if offsets is not None:
+            # Where extrusion folds faces over, e.g. in the creases of a dense scan, a single folded face would widen
+            # the normal cone of its cluster until it could never be culled, so keep folded faces together.
+            min_dots = np.ones(face_normals.shape[0], face_normals.dtype)
+            for offset in offsets:
+                extruded, _ = _face_normals((self.vertices + self.normals * offset)[self.faces[:, :3]])
+                min_dots = np.minimum(min_dots, np.einsum("ij,ij->i", extruded, face_normals))
+            bucket = bucket * 2 + (min_dots < TURN_LIMIT)
+
+        centroids = corners.mean(axis=1)
+        low, high = centroids.min(axis=0), centroids.max(axis=0)
+        grid = ((centroids - low) / np.maximum(high - low, 1e-9) * 1023).astype("uint32")
+        order = np.lexsort((_morton_code(grid), bucket))
+
+        self.faces = self.faces[order]
+        corners = corners[order]
+        face_normals = face_normals[order]
+        bucket = bucket[order]
+
+        # Split into clusters of at most max_faces, never spanning two buckets.
+        bucket_starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+        bucket_ends = np.append(bucket_starts[1:], bucket.shape[0])
+        starts = np.concatenate([np.arange(b, e, max_faces) for b, e in zip(bucket_starts, bucket_ends)])
+        counts = np.diff(np.append(starts, bucket.shape[0]))
+        cluster = np.repeat(np.arange(starts.shape[0]), counts)
+
+        # Bounding spheres, centered on each cluster's bounding box.
+        centers = (np.minimum.reduceat(corners.min(axis=1), starts) +
+                   np.maximum.reduceat(corners.max(axis=1), starts)) / 2
+        distances = np.linalg.norm(corners - centers[cluster][:, None], axis=2).max(axis=1)
+        radii = np.maximum.reduceat(distances, starts)
+
+        # Normal cones, about each cluster's average normal.
+        axes = np.add.reduceat(face_normals, starts)
+        axes /= np.maximum(np.linalg.norm(axes, axis=1, keepdims=True), 1e-9)
+        dots = np.einsum("ij,ij->i", face_normals, axes[cluster])
+        min_dots = np.minimum.reduceat(np.where(valid[order], dots, 1.0), starts)
+
+        self.clusters = MeshClusters(starts, counts, centers, radii, axes, _cone_cutoffs(min_dots))
+        self.cluster_args = (max_faces, None if offsets is None else np.array(offsets))
+        return self.clusters
+
     @staticmethod
     def from_obj_file(path: str) -> "Mesh":
         """
@@ -78,3 +258,44 @@ class Mesh:
             return Mesh(vertices, new_faces)
 
         return Mesh(vertices, faces)
+
+
+def _face_normals(corners: np.array) -> Tuple[np.array, np.array]:
+    """
+    Calculate the unit normal of each triangle.
+
+    :param corners: (N, 3, 3) array of each triangle's corners
+    :return: the normal of each triangle, and whether it is valid, i.e. the triangle is not degenerate
+    """
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    return normals, lengths[:, 0] > 0
+
+
+def _cone_cutoffs(min_dots: np.array) -> np.array:
+    """
+    Calculate the cutoff of each normal cone, as used by MeshClusters, from the smallest dot product between the
+    cone's axis and any normal within it.
+
+    :param min_dots: smallest dot product within each cone
+    """
+    with np.errstate(invalid="ignore"):
+        return np.where(min_dots > 0, np.sqrt(1 - np.minimum(min_dots, 1) ** 2), np.inf)
+
+
+def _morton_code(grid: np.array) -> np.array:
+    """
+    Interleave the bits of 10-bit x, y and z grid coordinates into a 30-bit Z-order curve index.
+
+    :param grid: (N, 3) array of integer grid coordinates between 0 and 1023
+    """
+    code = np.zeros(grid.shape[0], "uint32")
+    for i in range(3):
+        v = grid[:, i].astype("uint32")
+        v = (v | (v << 16)) & 0x030000FF
+        v = (v | (v << 8)) & 0x0300F00F
+        v = (v | (v << 4)) & 0x030C30C3
+        v = (v | (v << 2)) & 0x09249249
+        code |= v << i
+    return code
@@ -0,0 +1,300 @@
+import itertools
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+# Approximate bytes per texel of the texture internal formats we use, for memory accounting.
+TEXEL_SIZES = {
+    GL_RED: 1,
+    GL_R8: 1,
+    GL_RG: 2,
+    GL_RGB: 3,
+    GL_RGBA: 4,
+    GL_RGBA8: 4,
+    GL_R32F: 4,
+}
+
+BUFFER = "buffer"
+TEXTURE = "texture"
+VERTEX_ARRAY = "vertex array"
+SHADER = "shader"
+PROGRAM = "program"
+
+# Attribute holding the key which identifies an owner, assigned when it first owns an object.
+OWNER_KEY = "_gpu_resource_key"
+
+# Source of owner keys, which are never reused, unlike id().
+_owner_keys = itertools.count()
+
+
+class Resource:
+    """
+    A single OpenGL object, and the GPU memory allocated to it.
+    """
+
+    def __init__(self, kind: str, handle: int, owner: int):
+        self.kind = kind
+        self.handle = handle
+        self.owner = owner
+        self.size = 0
+
+
+class ResourceManager:
+    """
+    Tracks every OpenGL object created by the renderer and the GPU memory allocated to each, grouped by the object
+    which owns it, so that they can be released deterministically rather than whenever the garbage collector runs.
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        """
+        Initialise a new ResourceManager.
+
+        :param budget: maximum number of bytes which may be allocated across all resources, or None for no limit
+        """
+        self.budget = budget
+        self.resources: Dict[Tuple[str, int], Resource] = {}
+        self.labels: Dict[int, str] = {}
+        self.finalizers: Dict[int, weakref.finalize] = {}
+
+        # Cleared by teardown(), once the context (and everything in it) is about to be destroyed.
+        self.context_current = True
+
+    @staticmethod
+    def _key(owner: Any) -> Optional[int]:
+        """
+        Retrieve the key identifying an owner, or None if it has never owned any objects. This is a number stored on
+        the owner rather than its id(), which may be reused by a new object once the owner is garbage collected, or a
+        weak reference to it, which the garbage collector clears before finalising an owner in a reference cycle.
+
+        :param owner: the object responsible for releasing some objects
+        """
+        return getattr(owner, OWNER_KEY, None)
+
+    @staticmethod
+    def _label(owner: Any) -> str:
+        name = getattr(owner, "name", None)
+        if name is not None:
+            return f"{type(owner).__name__}({name})"
+        return f"{type(owner).__name__}@{id(owner):x}"
+
+    def _track(self, kind: str, handle: int, owner: Any) -> int:
+        """
+        Start tracking a newly created OpenGL object.
+
+        :param kind: the type of object
+        :param handle: its OpenGL name
+        :param owner: the object responsible for releasing it
+        :return: the object's OpenGL name
+        """
+        # Objects can only be created whilst a context is current, which may be a new one after a teardown.
+        self.context_current = True
+
+        handle = int(handle)
+        key = self._key(owner)
+        if key is None:
+            key = next(_owner_keys)
+            setattr(owner, OWNER_KEY, key)
+
+        if key not in self.labels:
+            self.labels[key] = self._label(owner)
+
+            # Release anything the owner still has once it is garbage collected, but not at interpreter exit, after
+            # the context is gone.
+            finalizer = weakref.finalize(owner, self._release_key, key)
+            finalizer.atexit = False
+            self.finalizers[key] = finalizer
+
+        self.resources[(kind, handle)] = Resource(kind, handle, key)
+        return handle
+
+    def _resize(self, kind: str, handle: int, size: int):
+        """
+        Record the number of bytes allocated to an object, checking the new total against the budget first.
+
+        :param kind: the type of object
+        :param handle: its OpenGL name
+        :param size: its new size in bytes
+        """
+        resource = self.resources[(kind, int(handle))]
+
+        if self.budget is not None:
+            total = self.total_bytes() - resource.size + size
+            if total > self.budget:
+                raise RuntimeError(
+                    f"Unable to allocate {size} bytes for {self.labels[resource.owner]}: "
+                    f"{total} bytes would exceed the GPU memory budget of {self.budget} bytes"
+                )
+
+        resource.size = size
+
+    def gen_buffer(self, owner: Any) -> int:
+        """
+        Create a new buffer object.
+
+        :param owner: the object responsible for releasing it
+        """
+        return self._track(BUFFER, glGenBuffers(1), owner)
+
+    def buffer_data(self, target: int, buffer: int, data: np.array, usage: int = GL_STATIC_DRAW):
+        """
+        Bind the given buffer to the target and upload the given data to it.
+
+        :param target: buffer binding target, e.g. GL_ARRAY_BUFFER
+        :param buffer: a buffer returned by gen_buffer
+        :param data: array of data to upload
+        :param usage: usage hint for the buffer
+        """
+        self._resize(BUFFER, buffer, data.nbytes)
+
+        glBindBuffer(target, buffer)
+        glBufferData(target, data, usage)
+
+    def gen_texture(self, owner: Any) -> int:
+        """
+        Create a new texture object.
+
+        :param owner: the object responsible for releasing it
+        """
+        return self._track(TEXTURE, glGenTextures(1), owner)
+
+    def tex_image_2d(self, texture: int, internal_format: int, width: int, height: int, data_format: int,
+                     data_type: int, data: Any):
+        """
+        Upload an image to the given texture, which must be bound to GL_TEXTURE_2D.
+
+        :param texture: a texture returned by gen_texture
+        :param internal_format: the format the texture is stored in on the GPU
+        :param width: the image's width
+        :param height: the image's height
+        :param data_format: the format of the given data
+        :param data_type: the type of each component of the given data
+        :param data: the image data
+        """
+        self._resize(TEXTURE, texture, width * height * TEXEL_SIZES.get(internal_format, 4))
+
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, data_format, data_type, data)
+
+    def gen_vertex_array(self, owner: Any) -> int:
+        """
+        Create a new vertex array object.
+
+        :param owner: the object responsible for releasing it
+        """
+        return self._track(VERTEX_ARRAY, glGenVertexArrays(1), owner)
+
+    def create_shader(self, owner: Any, shader_type: int) -> int:
+        """
+        Create a new shader object.
+
+        :param owner: the object responsible for releasing it
+        :param shader_type: e.g. GL_VERTEX_SHADER
+        """
+        return self._track(SHADER, glCreateShader(shader_type), owner)
+
+    def create_program(self, owner: Any) -> int:
+        """
+        Create a new shader program.
+
+        :param owner: the object responsible for releasing it
+        """
+        return self._track(PROGRAM, glCreateProgram(), owner)
+
+    def _delete(self, resources: List[Resource]):
+        """
+        Delete the given objects from the GPU, if the context is still current, and stop tracking them.
+
+        :param resources: the objects to delete
+        """
+        for resource in resources:
+            del self.resources[(resource.kind, resource.handle)]
+
+        if not self.context_current:
+            # The objects are destroyed along with the context.
+            return
+
+        handles = {kind: [r.handle for r in resources if r.kind == kind] for kind in
+                   (BUFFER, TEXTURE, VERTEX_ARRAY, SHADER, PROGRAM)}
+
+        if handles[BUFFER]:
+            glDeleteBuffers(len(handles[BUFFER]), np.array(handles[BUFFER], "uint32"))
+        if handles[TEXTURE]:
+            glDeleteTextures(np.array(handles[TEXTURE], "uint32"))
+        if handles[VERTEX_ARRAY]:
+            glDeleteVertexArrays(len(handles[VERTEX_ARRAY]), np.array(handles[VERTEX_ARRAY], "uint32"))
+        for program in handles[PROGRAM]:
+            glDeleteProgram(program)
+        for shader in handles[SHADER]:
+            glDeleteShader(shader)
+
+    def release(self, owner: Any):
+        """
+        Delete every object owned by the given owner.
+
+        :param owner: an owner previously passed when creating objects
+        """
+        key = self._key(owner)
+        if key is not None:
+            self._release_key(key)
+
+    def _release_key(self, key: int):
+        """
+        Delete every object owned by the owner with the given key.
+
+        :param key: the owner's key
+        """
+        self._delete([r for r in self.resources.values() if r.owner == key])
+        self.labels.pop(key, None)
+
+        finalizer = self.finalizers.pop(key, None)
+        if finalizer is not None:
+            finalizer.detach()
+
+    def teardown(self):
+        """
+        Delete every remaining object whilst the context is still current. Any later releases, e.g. from objects
+        being garbage collected after the window has closed, will not make any OpenGL calls.
+        """
+        self._delete(list(self.resources.values()))
+        self.labels.clear()
+
+        for finalizer in self.finalizers.values():
+            finalizer.detach()
+        self.finalizers.clear()
+        self.context_current = False
+
+    def bytes_owned(self, owner: Any) -> int:
+        """
+        Retrieve the number of bytes allocated to objects owned by the given owner.
+
+        :param owner: an owner previously passed when creating objects
+        """
+        key = self._key(owner)
+        if key is None:
+            return 0
+        return sum(r.size for r in self.resources.values() if r.owner == key)
+
+    def total_bytes(self) -> int:
+        """
+        Retrieve the number of bytes allocated across all objects.
+        """
+        return sum(r.size for r in self.resources.values())
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """
+        Summarise the objects currently allocated, grouped by owner.
+
+        :return: for each owner, the number of each type of object it owns and the total bytes allocated to them
+        """
+        report = {}
+        for resource in self.resources.values():
+            entry = report.setdefault(self.labels[resource.owner], {"bytes": 0})
+            entry["bytes"] += resource.size
+            entry[resource.kind] = entry.get(resource.kind, 0) + 1
+
+        return report
+
+
+# Resources used throughout the application.
+gpu_resources = ResourceManager()
@@ -1,4 +1,5 @@
 from os.path import realpath, join, dirname
+from typing import Any
 
 import numpy as np
 from OpenGL.GL import *
@@ -7,25 +8,53 @@ import pygame
 from ecm3423.camera import Camera
 from ecm3423.shaders import ShaderStore
 from ecm3423.mesh import Mesh
-from ecm3423.fur_model import FurModel
-from ecm3423.util import build_frustum_matrix, build_rotation_matrix_z, build_rotation_matrix_y, \
-    build_rotation_matrix_x, build_translation_matrix
+from ecm3423.resources import gpu_resources
+from ecm3423.instanced_fur_model import InstancedFurModel
+from ecm3423.fur_model import FurModel, FUR_MODES, FUR_MODE_BLEND, FUR_MODE_PREPASS, FUR_MODE_ALPHA_TEST
+from ecm3423.transforms import build_frustum_matrix, build_rotation_matrix_y, build_rotation_matrix_x, \
+    build_translation_matrix
 
 RESOURCE_PATH = join(dirname(realpath(__file__)), "..")
 
+# Keys which change the scene continuously whilst they are held, handled in Scene.update().
+HELD_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_l, pygame.K_k, pygame.K_m, pygame.K_n)
+
 
 class Scene:
     """
     The application's main scene, which manages the entire rendering pipeline, from model to screen.
     """
 
-    def __init__(self):
+    def __init__(self, fur_mode: str = FUR_MODE_PREPASS, n_props: int = 0):
+        """
+        Initialise a new Scene.
+
+        :param fur_mode: one of FUR_MODES, how to draw fur
+        :param n_props: number of small furry props to scatter on the ground around the models
+        """
         self.models = []
-        self.rot_speed = 0.2
+        self.fur_mode = fur_mode
+        self.n_props = n_props
+        # Rates of change per second whilst the corresponding key is held.
+        self.rot_speed = 1.5
+        self.length_speed = 0.05
+        self.density_speed = 2.5
         self.translation_speed = 2.0
         self.camera = Camera()
         self.shader_store = ShaderStore(join(RESOURCE_PATH, "shaders"))
-        self.mouse_rel_pos = None
+
+        # Mouse movement whilst dragging, accumulated between update steps.
+        self.mouse_delta = [0, 0]
+
+        # Keys from HELD_KEYS which are currently held down, and those pressed since the last update step, so that a
+        # key pressed and released between two steps still has an effect.
+        self.held_keys = set()
+        self.pressed_keys = set()
+
+        # Whether the scene must be redrawn regardless of whether anything in it has changed, e.g. when the window
+        # has been exposed, and the set of requesters which need a new frame drawn continuously, e.g. animations.
+        self.redraw = True
+        self.continuous_requests = set()
 
         near = 1.5
         far = 50
@@ -56,23 +85,159 @@ class Scene:
 
         M_bunny = np.matmul(build_translation_matrix([-2.0, 0.0, 0.0]), build_rotation_matrix_y(np.pi / 2.))
         bunny_mesh = Mesh.from_obj_file(join(RESOURCE_PATH, "models/bunny_world.obj"))
-        self.models.append(FurModel(bunny_mesh, self.shader_store.get("fur"), M=M_bunny))
+        self.models.append(FurModel(bunny_mesh, self.shader_store.get("fur"), M=M_bunny, name="bunny"))
 
         M_torus = np.matmul(build_translation_matrix([2.0, 0.0, 0.0]), build_rotation_matrix_x(np.pi / 2.))
         torus_mesh = Mesh.from_obj_file(join(RESOURCE_PATH, "models/torus.obj"))
-        self.models.append(FurModel(torus_mesh, self.shader_store.get("fur"), M=M_torus))
+        self.models.append(FurModel(torus_mesh, self.shader_store.get("fur"), M=M_torus, name="torus"))
+
+        if self.n_props > 0:
+            self.models.append(self.build_props(torus_mesh, self.n_props))
+
+    def build_props(self, mesh: Mesh, n: int) -> InstancedFurModel:
+        """
+        Scatter many small, randomly posed and coloured instances of a mesh over the ground beneath the models.
+
+        :param mesh: the mesh to scatter
+        :param n: the number of instances
+        """
+        rng = np.random.default_rng(0)
+        props = InstancedFurModel(mesh, self.shader_store.get("fur_instanced"), n, n_layers=10, name="props")
+
+        positions = np.stack((rng.uniform(-8.0, 8.0, n), np.full(n, -2.0), rng.uniform(-12.0, 2.0, n)), axis=-1)
+        props.set_pose_components(positions, rng.uniform(0.0, 2 * np.pi, n), rng.uniform(0.1, 0.3, n))
+        props.set_colors(props.shaders.color * rng.uniform(0.6, 1.4, (n, 1)))
+        props.set_fur(rng.uniform(0.5, 2.0, n), rng.uniform(0.5, 1.5, n))
+
+        return props
+
+    def teardown(self):
+        """
+        Release every OpenGL object used by the scene. Must be called whilst the context is still current.
+        """
+        for model in self.models:
+            model.release()
+        self.models = []
+
+        self.shader_store.release()
+        gpu_resources.teardown()
 
-    def draw(self):
+    def print_memory_report(self):
+        """
+        Print the GPU memory allocated for each model, and for every owner of OpenGL objects.
+        """
+        for model in self.models:
+            print(f"{model.name}: {model.gpu_bytes()} bytes ({model.gpu_bytes(include_shared=False)} not shared)")
+
+        for owner, entry in gpu_resources.report().items():
+            counts = ", ".join(f"{n} {kind}" for kind, n in entry.items() if kind != "bytes")
+            print(f"  {owner}: {entry['bytes']} bytes in {counts}")
+        print(f"total: {gpu_resources.total_bytes()} bytes")
+
+    def request_continuous_frames(self, requester: Any):
+        """
+        Keep drawing new frames, even when nothing in the scene has changed, until the given requester releases its
+        request with release_continuous_frames().
+
+        :param requester: object requesting frames, e.g. an animation
+        """
+        self.continuous_requests.add(requester)
+
+    def release_continuous_frames(self, requester: Any):
+        """
+        Release a request for continuous frames made with request_continuous_frames().
+
+        :param requester: object which requested frames
+        """
+        if requester in self.continuous_requests:
+            self.continuous_requests.remove(requester)
+            self.redraw = True
+
+    def needs_redraw(self) -> bool:
+        """
+        Determine whether anything visible has changed since the scene was last drawn.
+        """
+        return (self.redraw or bool(self.continuous_requests) or self.camera.changed or
+                any(model.changed for model in self.models))
+
+    def update(self, dt: float):
+        """
+        Advance the scene by one fixed update step, applying any input held down since the last step.
+
+        :param dt: length of the update step in seconds
+        """
+        self.camera.step()
+
+        keys = {key: key in self.held_keys or key in self.pressed_keys for key in HELD_KEYS}
+        self.pressed_keys.clear()
+
+        # Rotate the bunny with the arrow keys.
+        self.camera.rotate((keys[pygame.K_DOWN] - keys[pygame.K_UP]) * self.rot_speed * dt,
+                           (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * self.rot_speed * dt)
+
+        # Change the fur's length with L and K, and its density with M and N.
+        length = (keys[pygame.K_l] - keys[pygame.K_k]) * self.length_speed * dt
+        density = (keys[pygame.K_m] - keys[pygame.K_n]) * self.density_speed * dt
+        for model in self.models:
+            if length != 0:
+                model.set_length(model.length + length)
+            if density != 0:
+                model.set_density(model.density + density)
+
+        if self.mouse_delta != [0, 0]:
+            self.cursor_position_callback(*self.mouse_delta)
+            self.mouse_delta = [0, 0]
+
+        # Keep drawing whilst keys are held, even though no events arrive, so that their effect is continuous.
+        if self.held_keys:
+            self.request_continuous_frames("held keys")
+        else:
+            self.release_continuous_frames("held keys")
+
+    def wake(self, dt: float):
+        """
+        Apply the input which woke the scene from idle in a single update step. Moving objects are then drawn at their
+        new state until the next step, rather than interpolated from their state before the input, which has already
+        been drawn.
+
+        :param dt: length of the update step in seconds
+        """
+        self.update(dt)
+        self.camera.step()
+
+    def draw(self, alpha: float = 1.0):
         """
         Draw our scene's objects to the screen.
+
+        :param alpha: how far between the previous and current update step to draw moving objects, from 0.0 to 1.0
         """
+        self.redraw = False
+        self.camera.changed = False
+        for model in self.models:
+            model.changed = False
+
         glClearColor(0.52, 0.8, 0.92, 1.0)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-        self.camera.update()
+        self.camera.update(alpha)
+
+        if self.fur_mode == FUR_MODE_BLEND:
+            for model in self.models:
+                model.draw(self.P, self.camera.V)
+            return
+
+        # Depth pre-pass: draw the opaque base of every model first, so that fur hidden behind any model is rejected
+        # by the depth test. Only the alpha-tested shells may discard fragments, so the rest are rejected before they
+        # are shaded.
+        glDisable(GL_BLEND)
+        for model in self.models:
+            model.draw_base(self.P, self.camera.V)
 
+        if self.fur_mode != FUR_MODE_ALPHA_TEST:
+            glEnable(GL_BLEND)
         for model in self.models:
-            model.draw(self.P, self.camera.V)
+            model.draw_shells(self.P, self.camera.V, self.fur_mode)
+        glEnable(GL_BLEND)
 
     def cursor_position_callback(self, x: int, y: int):
         """
@@ -85,59 +250,57 @@ class Scene:
 
     def key_callback(self, key: int):
         """
-        Handle keyboard presses.
+        Handle keyboard presses. Keys which are held to change the scene are handled in update() instead.
 
         :param key: key involved in the event
         """
-        if key == pygame.K_l:
-            # increase fur length
-            for model in self.models:
-                model.set_length(model.length + 0.01)
-        elif key == pygame.K_k:
-            # decrease fur length
-            for model in self.models:
-                model.set_length(model.length - 0.01)
-        elif key == pygame.K_m:
-            # increase fur density
-            for model in self.models:
-                model.set_density(model.density + 0.5)
-        elif key == pygame.K_n:
-            # decrease fur density
-            for model in self.models:
-                model.set_density(model.density - 0.5)
-        elif key == pygame.K_b:
+        if key == pygame.K_b:
             # move fur in random direction
             psi = np.random.default_rng().normal()
             phi = np.random.default_rng().normal()
             for model in self.models:
                 model.set_direction(psi, phi)
-        elif key == pygame.K_UP:
-            # rotate the bunny upwards
-            self.camera.rotate(-self.rot_speed, 0)
-        elif key == pygame.K_DOWN:
-            # rotate the bunny downwards
-            self.camera.rotate(self.rot_speed, 0)
-        elif key == pygame.K_LEFT:
-            # rotate the bunny left
-            self.camera.rotate(0, -self.rot_speed)
-        elif key == pygame.K_RIGHT:
-            # rotate the bunny right
-            self.camera.rotate(0, self.rot_speed)
-
-    def process_events(self) -> bool:
-        for event in pygame.event.get():
+        elif key == pygame.K_o:
+            # cycle through the fur rendering modes
+            self.fur_mode = FUR_MODES[(FUR_MODES.index(self.fur_mode) + 1) % len(FUR_MODES)]
+            self.redraw = True
+        elif key == pygame.K_c:
+            # toggle culling of backfacing and off-screen clusters
+            FurModel.cull_clusters = not FurModel.cull_clusters
+            self.redraw = True
+        elif key == pygame.K_g:
+            # print a report of GPU memory usage
+            self.print_memory_report()
+
+    def process_events(self, timeout: int = 0) -> bool:
+        """
+        Handle all pending events.
+
+        :param timeout: if no events are pending, wait up to this many milliseconds for one to arrive
+        :return: False if the application should quit, otherwise True
+        """
+        events = pygame.event.get()
+        if not events and timeout > 0:
+            event = pygame.event.wait(timeout)
+            if event.type != pygame.NOEVENT:
+                events = [event] + pygame.event.get()
+
+        for event in events:
             if event.type == pygame.QUIT:
                 return False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE, pygame.ACTIVEEVENT):
+                # The window's contents may have been lost or changed.
+                self.redraw = True
             elif event.type == pygame.KEYDOWN:
+                if event.key in HELD_KEYS:
+                    self.held_keys.add(event.key)
+                    self.pressed_keys.add(event.key)
                 self.key_callback(event.key)
+            elif event.type == pygame.KEYUP:
+                self.held_keys.discard(event.key)
             elif event.type == pygame.MOUSEMOTION:
-                if pygame.mouse.get_pressed(3)[0]:
-                    if self.mouse_rel_pos is not None:
-                        self.mouse_rel_pos = pygame.mouse.get_rel()
-                        self.cursor_position_callback(*self.mouse_rel_pos)
-                    else:
-                        self.mouse_rel_pos = pygame.mouse.get_rel()
-                else:
-                    self.mouse_rel_pos = None
+                if event.buttons[0]:
+                    self.mouse_delta[0] += event.rel[0]
+                    self.mouse_delta[1] += event.rel[1]
 
         return True
@@ -1,10 +1,11 @@
-from typing import TypeVar, Dict, Any, Optional
+from typing import TypeVar, Dict, Any, Optional, Sequence
 from os.path import join
 
 import numpy as np
 from OpenGL.GL import *
 
-from ecm3423.util import homogenise, unhomogenise
+from ecm3423.resources import gpu_resources
+from ecm3423.transforms import homogenise, unhomogenise
 
 
 class Uniform:
@@ -71,8 +72,21 @@ class Shaders:
     color = np.array([150 / 255, 128 / 255, 124 / 255], "f")
     Ns = 0.5
 
-    def __init__(self, name: str, vertex_shader_path: str, fragment_shader_path: str):
+    resources = gpu_resources
+
+    def __init__(self, name: str, vertex_shader_path: str, fragment_shader_path: str, defines: Sequence[str] = ()):
+        """
+        Initialise a new shader program from the given source files.
+
+        :param name: name identifying the program in errors and GPU memory reports
+        :param vertex_shader_path: path to the vertex shader's source
+        :param fragment_shader_path: path to the fragment shader's source
+        :param defines: preprocessor macros to define before compiling both shaders, enabling optional features
+        """
         self.name = name
+        self.vertex_shader_path = vertex_shader_path
+        self.fragment_shader_path = fragment_shader_path
+        self.defines = tuple(defines)
         self.vertex_shader = None
         self.fragment_shader = None
         self.geometry_shader = None
@@ -94,11 +108,52 @@ class Shaders:
             "Ns": Uniform("Ns", self.Ns),
         }
 
+        # Variants of this program compiled with additional macros defined, created by variant().
+        self.variants: Dict[tuple, "Shaders"] = {}
+
+        # Scratch buffers which update_matrices() calculates the transformation uniforms in, to avoid allocating on
+        # every draw.
+        self._VM = np.empty((4, 4), "f")
+        self._PVM = np.empty((4, 4), "f")
+        self._light = np.empty(4, "f")
+        self._light_vs = np.empty(4, "f")
+        self._light_uniform = np.empty(3, "f")
+
         with open(vertex_shader_path, "r") as vsh:
-            self.vertex_shader_source = vsh.read()
+            self.vertex_shader_source = self._define(vsh.read())
 
         with open(fragment_shader_path, "r") as fsh:
-            self.fragment_shader_source = fsh.read()
+            self.fragment_shader_source = self._define(fsh.read())
+
+    def _define(self, source: str) -> str:
+        """
+        Insert this program's preprocessor macros into the given shader source, after its #version directive, which
+        must come first.
+
+        :param source: shader source code
+        """
+        if not self.defines:
+            return source
+
+        version, _, rest = source.partition("\n")
+        return "\n".join([version] + [f"#define {define}" for define in self.defines] + [rest])
+
+    def variant(self, *defines: str) -> "Shaders":
+        """
+        Retrieve a variant of this program, compiled from the same sources with the given macros also defined. Each
+        variant is only created once, and is compiled and released along with this program.
+
+        :param defines: preprocessor macros to define, e.g. "ALPHA_TEST"
+        """
+        key = tuple(sorted(defines))
+        if key not in self.variants:
+            variant = type(self)(f"{self.name}[{', '.join(key)}]", self.vertex_shader_path,
+                                 self.fragment_shader_path, self.defines + key)
+            if self.program is not None:
+                variant.compile()
+            self.variants[key] = variant
+
+        return self.variants[key]
 
     def bind_attributes(self, attributes: Dict[str, int]):
         """
@@ -113,24 +168,30 @@ class Shaders:
         """
         Compile shader source code.
         """
-        self.vertex_shader = glCreateShader(GL_VERTEX_SHADER)
+        if self.program is not None:
+            self.release()
+
+        self.vertex_shader = self.resources.create_shader(self, GL_VERTEX_SHADER)
         glShaderSource(self.vertex_shader, self.vertex_shader_source)
         glCompileShader(self.vertex_shader)
 
         if glGetShaderiv(self.vertex_shader, GL_COMPILE_STATUS) == GL_FALSE:
             raise RuntimeError("Failed to compile vertex shader:\n" + glGetShaderInfoLog(self.vertex_shader).decode("utf-8"))
 
-        self.fragment_shader = glCreateShader(GL_FRAGMENT_SHADER)
+        self.fragment_shader = self.resources.create_shader(self, GL_FRAGMENT_SHADER)
         glShaderSource(self.fragment_shader, self.fragment_shader_source)
         glCompileShader(self.fragment_shader)
 
         if glGetShaderiv(self.fragment_shader, GL_COMPILE_STATUS) == GL_FALSE:
             raise RuntimeError("Failed to compile fragment shader:\n" + glGetShaderInfoLog(self.fragment_shader).decode("utf-8"))
 
-        self.program = glCreateProgram()
+        self.program = self.resources.create_program(self)
         glAttachShader(self.program, self.vertex_shader)
         glAttachShader(self.program, self.fragment_shader)
 
+        for variant in self.variants.values():
+            variant.compile()
+
     def add_uniform(self, name: str, value: Optional[Any] = None):
         """
         Add a new uniform to the shader. Must be declared within the shader.
@@ -175,6 +236,31 @@ class Shaders:
 
             self.uniforms[uname].location = location
 
+    def update_matrices(self, P: np.array, V: np.array, M: np.array):
+        """
+        Calculate the transformation uniforms for the given matrices. This is the CPU side of use(), and does not
+        require an OpenGL context.
+
+        :param P: projection matrix
+        :param V: view matrix
+        :param M: model matrix
+        """
+        VM = np.matmul(V, M, out=self._VM)
+
+        self.set_uniform("PVM", np.matmul(P, VM, out=self._PVM))
+        self.set_uniform("VM", VM)
+        self.set_uniform("VMiT", np.linalg.inv(VM[:3, :3].T))
+        self.set_uniform("light", self._light_view(V))
+
+    def _light_view(self, V: np.array) -> np.array:
+        """
+        Transform the light's position into view space.
+
+        :param V: view matrix
+        """
+        light = np.matmul(V, homogenise(self.light, out=self._light), out=self._light_vs)
+        return unhomogenise(light, out=self._light_uniform)
+
     def use(self, P: np.array, V: np.array, M: np.array):
         """
         Start using this program during rendering.
@@ -186,14 +272,9 @@ class Shaders:
         if self.program == None:
             raise RuntimeError("cannot use program which has not been compiled yet")
 
-        VM = np.matmul(V, M)
-
         glUseProgram(self.program)
 
-        self.set_uniform("PVM", np.matmul(P, VM))
-        self.set_uniform("VM", VM)
-        self.set_uniform("VMiT", np.linalg.inv(VM[:3, :3].T))
-        self.set_uniform("light", unhomogenise(np.dot(V, homogenise(self.light))))
+        self.update_matrices(P, V, M)
 
         for uniform in self.uniforms.values():
             uniform.bind()
@@ -204,6 +285,49 @@ class Shaders:
         """
         glUseProgram(0)
 
+    def release(self):
+        """
+        Delete this program and its shaders. It must be compiled again before it can be used.
+        """
+        for variant in self.variants.values():
+            variant.release()
+
+        self.resources.release(self)
+        self.vertex_shader = None
+        self.fragment_shader = None
+        self.program = None
+
+
+class InstancedShaders(Shaders):
+    """
+    Represents a GL shader program which draws many instances of a model at once, taking each instance's model matrix
+    from a per-instance attribute rather than a uniform.
+    """
+
+    def __init__(self, name: str, vertex_shader_path: str, fragment_shader_path: str, defines: Sequence[str] = ()):
+        super().__init__(name, vertex_shader_path, fragment_shader_path, defines)
+
+        # Matrices involving the model matrix, and the colour, are per-instance attributes instead.
+        for uname in ("PVM", "VM", "VMiT", "color"):
+            del self.uniforms[uname]
+
+        self.uniforms["PV"] = Uniform("PV")
+        self.uniforms["V"] = Uniform("V")
+        self.uniforms["ViT"] = Uniform("ViT")
+
+    def update_matrices(self, P: np.array, V: np.array, M: np.array = None):
+        """
+        Calculate the transformation uniforms for the given matrices. This does not require an OpenGL context.
+
+        :param P: projection matrix
+        :param V: view matrix
+        :param M: ignored, as each instance has its own model matrix
+        """
+        self.set_uniform("PV", np.matmul(P, V, out=self._PVM))
+        self.set_uniform("V", V)
+        self.set_uniform("ViT", np.linalg.inv(V[:3, :3].T))
+        self.set_uniform("light", self._light_view(V))
+
 
 class ShaderStore:
     def __init__(self, path: str):
@@ -211,7 +335,11 @@ class ShaderStore:
             "fur": Shaders("fur",
                 vertex_shader_path=join(path, "fur/vertex.glsl"),
                 fragment_shader_path=join(path, "fur/fragment.glsl")
-            )
+            ),
+            "fur_instanced": InstancedShaders("fur_instanced",
+                vertex_shader_path=join(path, "fur_instanced/vertex.glsl"),
+                fragment_shader_path=join(path, "fur_instanced/fragment.glsl")
+            ),
         }
 
     def compile(self):
@@ -221,6 +349,13 @@ class ShaderStore:
         for name in self.shaders:
             self.shaders[name].compile()
 
+    def release(self):
+        """
+        Delete all the shaders in the store.
+        """
+        for name in self.shaders:
+            self.shaders[name].release()
+
     def get(self, shader_name: str) -> Shaders:
         """
         Retrieve a shader from the store by its name.
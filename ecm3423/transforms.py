@@ -0,0 +1,292 @@
+"""
+Float32 transform builders which write into caller-provided output buffers.
+
+Each builder replaces the deprecated one of the same name in ecm3423.util, but rather than allocating fresh float64
+arrays from Python lists on every call, the result is written in place into ``out`` (a new float32 array is only
+allocated when ``out`` is omitted). The ``*_matrices`` builders are batched forms which build an (N, 4, 4) stack of
+matrices in a single vectorised call.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+DTYPE = np.float32
+
+
+def _output(out: Optional[np.ndarray], shape: tuple) -> np.ndarray:
+    """
+    Return the given output buffer after checking its shape and type, or allocate a new one if none was given.
+
+    :param out: caller-provided output buffer, or None
+    :param shape: shape the output buffer must have
+    """
+    if out is None:
+        return np.empty(shape, dtype=DTYPE)
+
+    if out.shape != shape:
+        raise ValueError(f"output buffer has shape {out.shape}, expected {shape}")
+    if out.dtype != DTYPE:
+        raise ValueError(f"output buffer has dtype {out.dtype}, expected {np.dtype(DTYPE)}")
+
+    return out
+
+
+def build_identity_matrix(out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 identity matrix.
+
+    :param out: optional 4x4 float32 output buffer
+    """
+    out = _output(out, (4, 4))
+    out[...] = 0.0
+    out[0, 0] = out[1, 1] = out[2, 2] = out[3, 3] = 1.0
+    return out
+
+
+def build_translation_matrix(t: Sequence[float], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 translation matrix.
+
+    :param t: x, y and z translation
+    :param out: optional 4x4 float32 output buffer
+    """
+    out = build_identity_matrix(out)
+    out[:3, 3] = t
+    return out
+
+
+def build_scale_matrix(x: float, y: float, z: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 scale matrix.
+
+    :param x: scale along the x axis
+    :param y: scale along the y axis
+    :param z: scale along the z axis
+    :param out: optional 4x4 float32 output buffer
+    """
+    out = build_identity_matrix(out)
+    out[0, 0] = x
+    out[1, 1] = y
+    out[2, 2] = z
+    return out
+
+
+def build_rotation_matrix_x(psi: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 rotation matrix about the x axis.
+
+    :param psi: angle of rotation in radians
+    :param out: optional 4x4 float32 output buffer
+    """
+    s, c = np.sin(psi), np.cos(psi)
+    out = build_identity_matrix(out)
+    out[1, 1] = c
+    out[1, 2] = s
+    out[2, 1] = -s
+    out[2, 2] = c
+    return out
+
+
+def build_rotation_matrix_y(phi: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 rotation matrix about the y axis.
+
+    :param phi: angle of rotation in radians
+    :param out: optional 4x4 float32 output buffer
+    """
+    s, c = np.sin(phi), np.cos(phi)
+    out = build_identity_matrix(out)
+    out[0, 0] = c
+    out[0, 2] = s
+    out[2, 0] = -s
+    out[2, 2] = c
+    return out
+
+
+def build_rotation_matrix_z(theta: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build a 4x4 rotation matrix about the z axis.
+
+    :param theta: angle of rotation in radians
+    :param out: optional 4x4 float32 output buffer
+    """
+    s, c = np.sin(theta), np.cos(theta)
+    out = build_identity_matrix(out)
+    out[0, 0] = c
+    out[0, 1] = s
+    out[1, 0] = -s
+    out[1, 1] = c
+    return out
+
+
+def build_rotation_matrix_xy(psi: float, phi: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Build the product of the x and y rotation matrices directly, without building either as a temporary.
+
+    :param psi: angle of rotation about the x axis in radians
+    :param phi: angle of rotation about the y axis in radians
+    :param out: optional 4x4 float32 output buffer
+    """
+    sx, cx = np.sin(psi), np.cos(psi)
+    sy, cy = np.sin(phi), np.cos(phi)
+
+    out = _output(out, (4, 4))
+    out[0] = cy, 0.0, sy, 0.0
+    out[1] = -sx * sy, cx, sx * cy, 0.0
+    out[2] = -cx * sy, -sx, cx * cy, 0.0
+    out[3] = 0.0, 0.0, 0.0, 1.0
+    return out
+
+
+def build_frustum_matrix(
+    left: float, right: float, bottom: float, top: float, near: float, far: float, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Build a perspective projection matrix for the given view frustum.
+
+    :param left: left clipping plane
+    :param right: right clipping plane
+    :param bottom: bottom clipping plane
+    :param top: top clipping plane
+    :param near: near clipping plane
+    :param far: far clipping plane
+    :param out: optional 4x4 float32 output buffer
+    """
+    out = _output(out, (4, 4))
+    out[...] = 0.0
+    out[0, 0] = 2 * near / (right - left)
+    out[0, 2] = (right + left) / (right - left)
+    out[1, 1] = -2 * near / (top - bottom)
+    out[1, 2] = (top + bottom) / (top - bottom)
+    out[2, 2] = -(far + near) / (far - near)
+    out[2, 3] = -2 * far * near / (far - near)
+    out[3, 2] = -1.0
+    return out
+
+
+def build_pose_matrix(
+    position: Sequence[float] = (0.0, 0.0, 0.0),
+    orientation: float = 0.0,
+    scale: Sequence[float] = (1.0, 1.0, 1.0),
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Build a model pose matrix T * Rz * S in one pass.
+
+    :param position: x, y and z position
+    :param orientation: rotation about the z axis in radians
+    :param scale: x, y and z scale
+    :param out: optional 4x4 float32 output buffer
+    """
+    s, c = np.sin(orientation), np.cos(orientation)
+
+    out = _output(out, (4, 4))
+    out[0] = c * scale[0], s * scale[1], 0.0, position[0]
+    out[1] = -s * scale[0], c * scale[1], 0.0, position[1]
+    out[2] = 0.0, 0.0, scale[2], position[2]
+    out[3] = 0.0, 0.0, 0.0, 1.0
+    return out
+
+
+def build_pose_matrices(
+    positions: np.ndarray,
+    orientations: Optional[np.ndarray] = None,
+    scales: Optional[np.ndarray] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Build a stack of model pose matrices, one per instance, in a single vectorised call.
+
+    :param positions: (N, 3) array of positions
+    :param orientations: optional (N,) array of rotations about the z axis in radians
+    :param scales: optional (N, 3) array of per-axis scales, or (N,) array of uniform scales
+    :param out: optional (N, 4, 4) float32 output buffer
+    """
+    positions = np.asarray(positions)
+    n = positions.shape[0]
+    out = _output(out, (n, 4, 4))
+
+    # Each term is written straight into its slice of out, and scaled there, so no (N,)-sized temporaries are
+    # allocated. Scaling applies to each column of the rotation, so a uniform scale is used for all three.
+    if scales is not None:
+        scales = np.asarray(scales)
+        sx, sy, sz = (scales,) * 3 if scales.ndim == 1 else scales.T
+
+    out[...] = 0.0
+    if orientations is None:
+        out[:, 0, 0] = 1.0 if scales is None else sx
+        out[:, 1, 1] = 1.0 if scales is None else sy
+    else:
+        np.cos(orientations, out=out[:, 1, 1])
+        np.sin(orientations, out=out[:, 0, 1])
+        np.negative(out[:, 0, 1], out=out[:, 1, 0])
+        if scales is None:
+            out[:, 0, 0] = out[:, 1, 1]
+        else:
+            np.multiply(out[:, 1, 1], sx, out=out[:, 0, 0])
+            out[:, 1, 1] *= sy
+            out[:, 0, 1] *= sy
+            out[:, 1, 0] *= sx
+    out[:, 2, 2] = 1.0 if scales is None else sz
+
+    out[:, :3, 3] = positions
+    out[:, 3, 3] = 1.0
+    return out
+
+
+def build_rotation_matrices_xy(
+    psi: np.ndarray, phi: np.ndarray, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Build a stack of combined x and y rotation matrices in a single vectorised call.
+
+    :param psi: (N,) array of rotations about the x axis in radians
+    :param phi: (N,) array of rotations about the y axis in radians
+    :param out: optional (N, 4, 4) float32 output buffer
+    """
+    psi = np.asarray(psi)
+    phi = np.asarray(phi)
+    out = _output(out, (psi.shape[0], 4, 4))
+
+    # The sines and cosines are written into the slices of out which hold them directly, and the products are built
+    # from those slices, so no (N,)-sized temporaries are allocated.
+    out[...] = 0.0
+    np.cos(phi, out=out[:, 0, 0])
+    np.sin(phi, out=out[:, 0, 2])
+    np.cos(psi, out=out[:, 1, 1])
+    np.sin(psi, out=out[:, 2, 1])
+
+    np.multiply(out[:, 2, 1], out[:, 0, 2], out=out[:, 1, 0])
+    np.negative(out[:, 1, 0], out=out[:, 1, 0])
+    np.multiply(out[:, 2, 1], out[:, 0, 0], out=out[:, 1, 2])
+    np.multiply(out[:, 1, 1], out[:, 0, 2], out=out[:, 2, 0])
+    np.negative(out[:, 2, 0], out=out[:, 2, 0])
+    np.multiply(out[:, 1, 1], out[:, 0, 0], out=out[:, 2, 2])
+    np.negative(out[:, 2, 1], out=out[:, 2, 1])
+    out[:, 3, 3] = 1.0
+    return out
+
+
+def homogenise(vec: Sequence[float], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Append a w component of 1 to the given 3D vector.
+
+    :param vec: x, y and z components
+    :param out: optional 4-element float32 output buffer
+    """
+    out = _output(out, (4,))
+    out[:3] = vec
+    out[3] = 1.0
+    return out
+
+
+def unhomogenise(vec: Sequence[float], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Divide the x, y and z components of the given homogeneous 4D vector by its w component.
+
+    :param vec: x, y, z and w components
+    :param out: optional 3-element float32 output buffer
+    """
+    out = _output(out, (3,))
+    np.divide(vec[:3], vec[3], out=out)
+    return out
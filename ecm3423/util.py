@@ -1,7 +1,27 @@
+import functools
+import warnings
+
 import numpy as np
-from typing import List
+from typing import Callable, List
+
+
+def deprecated(fn: Callable) -> Callable:
+    """
+    Mark a builder as deprecated in favour of the float32 builder of the same name in ecm3423.transforms, which can
+    write into an existing array rather than allocating a new one on every call.
+
+    :param fn: the deprecated builder
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        warnings.warn(f"ecm3423.util.{fn.__name__} is deprecated, use ecm3423.transforms.{fn.__name__} instead",
+                      DeprecationWarning, stacklevel=2)
+        return fn(*args, **kwargs)
+
+    return wrapper
 
 
+@deprecated
 def build_translation_matrix(t: List[float]) -> np.array:
     n = len(t)
     T = np.identity(n + 1, dtype="f")
@@ -9,6 +29,7 @@ def build_translation_matrix(t: List[float]) -> np.array:
     return T
 
 
+@deprecated
 def build_scale_matrix(x: float, y: float, z: float) -> np.array:
     return np.array([
         [x, 0, 0, 0],
@@ -27,6 +48,7 @@ def build_elementary_rotation_matrix(theta: float) -> np.array:
     ])
 
 
+@deprecated
 def build_rotation_matrix_x(psi: float) -> np.array:
     Rx = np.identity(4)
     Rx[1:3, 1:3] = build_elementary_rotation_matrix(psi)
@@ -34,6 +56,7 @@ def build_rotation_matrix_x(psi: float) -> np.array:
     return Rx
 
 
+@deprecated
 def build_rotation_matrix_y(phi: float) -> np.array:
     Ry = np.identity(4)
     Ry[0:3:2, 0:3:2] = build_elementary_rotation_matrix(phi)
@@ -41,6 +64,7 @@ def build_rotation_matrix_y(phi: float) -> np.array:
     return Ry
 
 
+@deprecated
 def build_rotation_matrix_z(theta: float) -> np.array:
     Rz = np.identity(4)
     Rz[0:2, 0:2] = build_elementary_rotation_matrix(theta)
@@ -48,8 +72,10 @@ def build_rotation_matrix_z(theta: float) -> np.array:
     return Rz
 
 
+@deprecated
 def build_rotation_matrix_xy(psi: float, phi: float) -> np.array:
-    return np.matmul(build_rotation_matrix_x(psi), build_rotation_matrix_y(phi))
+    # Call the undecorated builders, so that only the caller's own call is warned about.
+    return np.matmul(build_rotation_matrix_x.__wrapped__(psi), build_rotation_matrix_y.__wrapped__(phi))
 
 
 def build_orthographic_projection_matrix(
@@ -65,6 +91,7 @@ def build_orthographic_projection_matrix(
     )
 
 
+@deprecated
 def build_frustum_matrix(
     left: float, right: float, bottom: float, top: float, near: float, far: float
 ) -> np.array:
@@ -78,21 +105,25 @@ def build_frustum_matrix(
     )
 
 
+@deprecated
 def build_pose_matrix(
     position: List[float] = [0, 0, 0],
     orientation: float = 0,
     scale: List[float] = [1, 1, 1],
 ):
-    R = build_rotation_matrix_z(orientation)
-    T = build_translation_matrix(position)
-    S = build_scale_matrix(scale[0], scale[1], scale[2])
+    # Call the undecorated builders, so that only the caller's own call is warned about.
+    R = build_rotation_matrix_z.__wrapped__(orientation)
+    T = build_translation_matrix.__wrapped__(position)
+    S = build_scale_matrix.__wrapped__(scale[0], scale[1], scale[2])
 
     return np.matmul(np.matmul(T, R), S)
 
 
+@deprecated
 def homogenise(vec):
     return np.hstack([vec, 1.0])
 
 
+@deprecated
 def unhomogenise(vec):
     return vec[:-1] / vec[-1]
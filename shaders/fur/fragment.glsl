@@ -2,6 +2,9 @@
 
 uniform vec3 color;
 uniform float density;
+#ifdef ALPHA_TEST
+uniform float alpha_threshold;
+#endif
 
 uniform vec3 light;
 uniform sampler2D noise_texture;
@@ -28,4 +31,14 @@ void main()
                                              // Otherwise, 0.0.
     frag_color = vec4(smoothstep(0.2, 1.0, fs_layer) * fs_color,
         base_of_fur + (1 - base_of_fur) * sample.r * (1 - fs_layer));
+
+    /* Discard texels with too little fur when the shells are alpha-tested
+     * rather than blended. This is only compiled into the alpha-tested
+     * shells' program, as a GPU cannot depth test fragments from a program
+     * which may discard them until after they are shaded. */
+#ifdef ALPHA_TEST
+    if (frag_color.a < alpha_threshold) {
+        discard;
+    }
+#endif
 }
@@ -0,0 +1,69 @@
+#version 140
+
+uniform mat4 PV;
+uniform mat4 V;
+uniform mat3 ViT;
+
+// Lighting parameters.
+uniform vec3 light;
+uniform vec3 Ia;
+uniform vec3 Id;
+uniform vec3 Is;
+uniform vec3 Ka;
+uniform vec3 Kd;
+uniform vec3 Ks;
+uniform float Ns;
+
+// Fur parameters.
+uniform float density;
+uniform vec3 gravity;
+
+in vec3 position;
+in vec3 normal;
+in float layer;
+
+// Per-instance parameters: the instance's pose matrix and the inverse
+// transpose of its upper 3x3 for transforming normals, its colour, and
+// multipliers for the fur's density and length.
+in mat4 instance_M;
+in mat3 instance_MiT;
+in vec3 instance_color;
+in vec2 instance_fur;
+
+out vec3 fs_normal;
+out vec3 fs_color;
+flat out float fs_layer;
+flat out float fs_density;
+
+void main()
+{
+    /* This shader is the same as the fur vertex shader, but takes the model
+     * matrix, colour and fur parameters from per-instance attributes. */
+    mat4 VM = V * instance_M;
+    fs_normal = normalize(ViT * instance_MiT * normal);
+    vec3 position_vs = vec3(VM * vec4(position, 1.0f));
+    vec3 light_direction = normalize(light - position_vs);
+
+    // Lighting components for Gouraud shading.
+    vec3 ambient = Ia * Ka;
+    vec3 diffuse = Id * Kd * max(0.0f, dot(light_direction, fs_normal));
+    vec3 specular = Is * Ks * pow(max(0.0, dot(
+        reflect(light_direction, position_vs), normalize(position_vs)))
+    , Ns);
+
+    /* Implement the inverse square law and reduce the light intensity over
+     * distance from the light source. */
+    float distance_from_light = length(light - position_vs);
+    float attenuation = min(1.0,
+        1.0 / (pow(distance_from_light, 2) * 0.005));
+
+    fs_color = instance_color * (ambient + attenuation * (diffuse + specular));
+
+    // Pass the layer and density through to the fragment shader.
+    fs_layer = layer;
+    fs_density = density * instance_fur.x;
+
+    // Add gravity for each layer of fur.
+    gl_Position = PV * instance_M *
+        vec4(position + gravity * instance_fur.y * pow(layer, 3), 1.0);
+}
@@ -0,0 +1,34 @@
+from typing import Dict
+
+import pytest
+
+from ecm3423.benchmark import compare
+
+
+def results(times: Dict[str, float], pattern: str = None) -> Dict:
+    current = {"machine": {}, "results": {name: {"min": t, "median": t} for name, t in times.items()}}
+    if pattern is not None:
+        current["pattern"] = pattern
+    return current
+
+
+BASELINE = results({"Mesh.from_obj_file[torus]": 1.0, "transforms.build_pose_matrix": 1.0})
+
+
+def test_compare_passes_within_threshold():
+    assert compare(BASELINE, results({"Mesh.from_obj_file[torus]": 1.05, "transforms.build_pose_matrix": 0.5}), 0.1)
+
+
+def test_compare_fails_on_regression():
+    assert not compare(BASELINE, results({"Mesh.from_obj_file[torus]": 1.2, "transforms.build_pose_matrix": 1.0}), 0.1)
+
+
+def test_compare_allows_new_benchmarks():
+    current = results({"Mesh.from_obj_file[torus]": 1.0, "transforms.build_pose_matrix": 1.0, "new": 1.0})
+    assert compare(BASELINE, current, 0.1)
+
+
+@pytest.mark.parametrize("pattern, ok", [(None, False), ("Mesh", True), ("transforms", False)])
+def test_compare_fails_on_missing_benchmarks(pattern, ok):
+    # Only benchmarks which the current run was filtered to leave out may be missing.
+    assert compare(BASELINE, results({"Mesh.from_obj_file[torus]": 1.0}, pattern), 0.1) == ok
@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from ecm3423 import fur_buffers
+from ecm3423.fur_buffers import FurBuffers
+from ecm3423.instanced_fur_model import INSTANCE_ATTRIBUTES, INSTANCE_SIZE, InstancedFurModel
+from ecm3423.transforms import build_pose_matrices
+
+N_INSTANCES = 10
+COLOR = np.array([0.2, 0.4, 0.6], "f")
+
+
+class FakeGPU:
+    """
+    Stands in for both the GPU resource manager and the fur buffer cache, neither of which can be used without an
+    OpenGL context.
+    """
+
+    def gen_vertex_array(self, owner) -> int:
+        return 0
+
+    def gen_texture(self, owner) -> int:
+        return 0
+
+    def acquire(self, mesh, n_layers: int, length: float) -> SimpleNamespace:
+        return SimpleNamespace(attributes={})
+
+    def release(self, owner):
+        pass
+
+
+@pytest.fixture
+def model(monkeypatch) -> InstancedFurModel:
+    gpu = FakeGPU()
+    monkeypatch.setattr(InstancedFurModel, "resources", gpu)
+    monkeypatch.setattr(InstancedFurModel, "buffer_cache", gpu)
+    monkeypatch.setattr(InstancedFurModel, "set_shaders", lambda self, shaders: None)
+    monkeypatch.setattr(InstancedFurModel, "_bind", lambda self: None)
+
+    model = InstancedFurModel(None, SimpleNamespace(color=COLOR), N_INSTANCES)
+    yield model
+    model.release()
+
+
+def attribute(model: InstancedFurModel, name: str) -> np.array:
+    offset, rows, columns = INSTANCE_ATTRIBUTES[name]
+    return model.instance_data[:, offset:offset + rows * columns]
+
+
+def test_attributes_pack_without_overlapping():
+    used = np.zeros(INSTANCE_SIZE, int)
+    for offset, rows, columns in INSTANCE_ATTRIBUTES.values():
+        used[offset:offset + rows * columns] += 1
+
+    np.testing.assert_array_equal(used, 1)
+
+
+def test_defaults(model):
+    np.testing.assert_array_equal(attribute(model, "instance_M"),
+                                  np.tile(np.identity(4, "f").ravel(), (N_INSTANCES, 1)))
+    np.testing.assert_array_equal(attribute(model, "instance_MiT"),
+                                  np.tile(np.identity(3, "f").ravel(), (N_INSTANCES, 1)))
+    np.testing.assert_array_equal(attribute(model, "instance_color"), np.tile(COLOR, (N_INSTANCES, 1)))
+    np.testing.assert_array_equal(attribute(model, "instance_fur"), 1.0)
+
+
+def test_poses_are_stored_by_column(model):
+    rng = np.random.default_rng(0)
+    M = build_pose_matrices(rng.uniform(-5.0, 5.0, (4, 3)), rng.uniform(-np.pi, np.pi, 4),
+                            rng.uniform(0.1, 2.0, (4, 3)))
+    model.set_poses(M, start=3)
+
+    # Each group of four floats is one column of the matrix, as GLSL expects.
+    stored = attribute(model, "instance_M")[3:7].reshape(-1, 4, 4)
+    np.testing.assert_array_equal(stored, np.transpose(M, (0, 2, 1)))
+
+
+def test_normal_matrices_are_inverse_transposes(model):
+    rng = np.random.default_rng(0)
+    M = build_pose_matrices(rng.uniform(-5.0, 5.0, (4, 3)), rng.uniform(-np.pi, np.pi, 4),
+                            rng.uniform(0.1, 2.0, (4, 3)))
+    model.set_poses(M, start=2)
+
+    # Stored by column, so reading the floats back row by row gives the transpose of instance_MiT.
+    MiT = np.transpose(attribute(model, "instance_MiT")[2:6].reshape(-1, 3, 3), (0, 2, 1))
+    np.testing.assert_allclose(MiT, np.transpose(np.linalg.inv(M[:, :3, :3]), (0, 2, 1)), rtol=1e-5, atol=1e-6)
+
+    # Normals transformed by it stay perpendicular to transformed tangents, even under non-uniform scaling.
+    tangent, normal = np.array([1.0, 1.0, 0.0]), np.array([1.0, -1.0, 0.0])
+    dots = np.einsum("ni,ni->n", M[:, :3, :3] @ tangent, MiT @ normal)
+    np.testing.assert_allclose(dots, 0.0, atol=1e-5)
+
+
+def test_dirty_ranges_merge(model):
+    model.dirty = None
+    model.changed = False
+
+    model.set_colors(np.ones((2, 3)), start=6)
+    assert model.dirty == (6, 8)
+    assert model.changed
+
+    model.set_fur(np.ones(1), np.ones(1), start=2)
+    assert model.dirty == (2, 8)
+
+    model.set_pose_components(np.zeros((1, 3)), start=4)
+    assert model.dirty == (2, 8)
+
+    model.set_colors(np.ones((1, 3)), start=9)
+    assert model.dirty == (2, 10)
+
+
+@pytest.mark.parametrize("start, n", [(-1, 1), (N_INSTANCES - 1, 2), (N_INSTANCES, 1)])
+def test_out_of_range_writes_raise(model, start, n):
+    data = model.instance_data.copy()
+    model.dirty = None
+
+    with pytest.raises(IndexError):
+        model.set_colors(np.zeros((n, 3)), start=start)
+
+    np.testing.assert_array_equal(model.instance_data, data)
+    assert model.dirty is None
+
+
+@pytest.mark.parametrize("layers", [range(1, 25), range(24, 0, -1)])
+def test_shells_are_drawn_in_one_call(model, monkeypatch, layers):
+    calls = []
+    monkeypatch.setattr(fur_buffers, "glDrawElementsInstanced", lambda *args: calls.append(args))
+    model.buffers = object.__new__(FurBuffers)
+    model.buffers.primitive, model.buffers.n_elements, model.buffers.n_layers = None, 25 * 3, 25
+
+    model._draw_layers(layers, None)
+
+    assert len(calls) == 1
+    _, count, _, offset, instances = calls[0]
+    assert (count, offset.value, instances) == (24 * 3, 3 * 4, N_INSTANCES)
@@ -0,0 +1,130 @@
+from os.path import dirname, join, realpath
+
+import numpy as np
+import pytest
+
+from ecm3423.mesh import TURN_LIMIT, Mesh
+
+MODELS_PATH = join(dirname(realpath(__file__)), "..", "models")
+
+
+@pytest.fixture(params=["torus", "bunny_world"])
+def mesh(request) -> Mesh:
+    return Mesh.from_obj_file(join(MODELS_PATH, f"{request.param}.obj"))
+
+
+def sorted_faces(faces: np.array) -> np.array:
+    return faces[np.lexsort(faces.T[::-1])]
+
+
+def face_normals(vertices: np.array, faces: np.array) -> np.array:
+    corners = vertices[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("max_faces", [16, 64])
+def test_clusters_permute_faces(mesh, max_faces):
+    faces = mesh.faces.copy()
+    mesh.build_clusters(max_faces)
+
+    assert mesh.faces.shape == faces.shape
+    np.testing.assert_array_equal(sorted_faces(mesh.faces), sorted_faces(faces))
+
+
+@pytest.mark.parametrize("max_faces", [16, 64])
+def test_clusters_are_contiguous(mesh, max_faces):
+    clusters = mesh.build_clusters(max_faces)
+
+    assert clusters.starts[0] == 0
+    np.testing.assert_array_equal(clusters.starts[1:], clusters.starts[:-1] + clusters.counts[:-1])
+    assert clusters.counts.sum() == mesh.faces.shape[0]
+    assert np.all(clusters.counts > 0) and np.all(clusters.counts <= max_faces)
+
+
+def test_clusters_are_only_built_once(mesh):
+    clusters = mesh.build_clusters()
+    faces = mesh.faces.copy()
+
+    assert mesh.build_clusters() is clusters
+    np.testing.assert_array_equal(mesh.faces, faces)
+
+
+@pytest.mark.parametrize("max_faces, offsets", [(16, None), (64, np.linspace(0.0, 0.2, 4))])
+def test_clusters_cannot_be_rebuilt_differently(mesh, max_faces, offsets):
+    mesh.build_clusters(offsets=np.linspace(0.0, 0.2, 10))
+    faces = mesh.faces.copy()
+
+    with pytest.raises(ValueError):
+        mesh.build_clusters(max_faces, offsets)
+    np.testing.assert_array_equal(mesh.faces, faces)
+
+
+def test_cluster_bounds_contain_faces(mesh):
+    clusters = mesh.build_clusters()
+    cluster = np.repeat(np.arange(len(clusters)), clusters.counts)
+
+    corners = mesh.vertices[mesh.faces]
+    distances = np.linalg.norm(corners - clusters.centers[cluster][:, None], axis=2)
+    assert np.all(distances <= clusters.radii[cluster][:, None] + 1e-5)
+
+    # Every face normal lies within its cluster's normal cone.
+    dots = np.einsum("ij,ij->i", face_normals(mesh.vertices, mesh.faces), clusters.axes[cluster])
+    cutoffs = clusters.cutoffs[cluster]
+    bounded = np.isfinite(cutoffs)
+    assert np.all(dots[bounded] >= np.sqrt(1 - cutoffs[bounded] ** 2) - 1e-5)
+
+
+def test_ranges_merge_adjacent_clusters(mesh):
+    clusters = mesh.build_clusters(16)
+    n = len(clusters)
+    visible = np.zeros(n, bool)
+    visible[[0, 1, 2, 5, n - 1]] = True
+
+    starts, counts = clusters.ranges(visible)
+
+    first = [0, 5, n - 1]
+    last = [2, 5, n - 1]
+    np.testing.assert_array_equal(starts, clusters.starts[first])
+    np.testing.assert_array_equal(counts, clusters.starts[last] + clusters.counts[last] - clusters.starts[first])
+    assert clusters.ranges(np.zeros(n, bool))[0].shape == (0,)
+
+
+def test_turned_faces_are_clustered_apart(mesh):
+    length, n_layers = 0.1, 25
+    offsets = length * np.arange(n_layers) / n_layers
+    clusters = mesh.build_clusters(offsets=offsets)
+
+    normals = face_normals(mesh.vertices, mesh.faces)
+    min_dots = np.min([np.einsum("ij,ij->i", face_normals(mesh.vertices + mesh.normals * offset, mesh.faces), normals)
+                       for offset in offsets], axis=0)
+    turned = np.add.reduceat((min_dots < TURN_LIMIT).astype("i"), clusters.starts)
+    assert np.all((turned == 0) | (turned == clusters.counts))
+
+
+@pytest.mark.parametrize("n_bands", [1, 2])
+def test_culling_keeps_front_facing_shells(mesh, n_bands):
+    """
+    No cluster containing a face which faces the camera, in the base mesh or any extruded shell within its band of
+    layers, may be culled.
+    """
+    length, n_layers = 0.1, 25
+    offsets = length * np.arange(n_layers) / n_layers
+    base = mesh.build_clusters(offsets=offsets)
+    cluster = np.repeat(np.arange(len(base)), base.counts)
+
+    # A frustum wide enough to contain the whole mesh, so that only backfacing clusters are culled.
+    PVM = np.diag([0.01, 0.01, 0.01, 1.0]).astype("f")
+
+    rng = np.random.default_rng(0)
+    for band in np.array_split(offsets, n_bands):
+        clusters = base.extrude(mesh, band)
+        for eye in rng.normal(size=(20, 3)) * 5.0:
+            visible = clusters.visible(eye, PVM, length)
+            assert not visible.all()
+
+            for offset in band:
+                vertices = mesh.vertices + mesh.normals * offset
+                centroids = vertices[mesh.faces].mean(axis=1)
+                facing = np.einsum("ij,ij->i", face_normals(vertices, mesh.faces), eye - centroids) > 0
+                assert np.all(visible[cluster[facing]])
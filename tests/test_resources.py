@@ -0,0 +1,97 @@
+import gc
+import itertools
+
+import pytest
+
+from ecm3423 import resources
+from ecm3423.resources import ResourceManager
+
+
+class Owner:
+    name = "owner"
+
+
+@pytest.fixture
+def deleted(monkeypatch) -> list:
+    """
+    Stands in for the OpenGL calls which create and delete textures, which cannot be made without a context.
+    """
+    handles = itertools.count(1)
+    deleted = []
+    monkeypatch.setattr(resources, "glGenTextures", lambda n: next(handles))
+    monkeypatch.setattr(resources, "glDeleteTextures", lambda textures: deleted.extend(textures))
+    return deleted
+
+
+def track_texture(manager: ResourceManager, owner: Owner) -> int:
+    texture = manager.gen_texture(owner)
+    manager._resize(resources.TEXTURE, texture, 1024)
+    return texture
+
+
+def test_release(deleted):
+    manager = ResourceManager()
+    owner = Owner()
+    texture = track_texture(manager, owner)
+    assert manager.bytes_owned(owner) == 1024
+    assert manager.report() == {"Owner(owner)": {"bytes": 1024, resources.TEXTURE: 1}}
+
+    manager.release(owner)
+    assert deleted == [texture]
+    assert manager.total_bytes() == 0
+    assert manager.report() == {}
+
+
+@pytest.mark.parametrize("cyclic", [False, True])
+def test_collected_owners_are_released(deleted, cyclic):
+    manager = ResourceManager()
+    owner = Owner()
+    if cyclic:
+        owner.self = owner
+    texture = track_texture(manager, owner)
+
+    del owner
+    gc.collect()
+    assert deleted == [texture]
+    assert manager.total_bytes() == 0
+    assert manager.report() == {}
+
+
+def test_releasing_from_del_in_a_cycle(deleted):
+    manager = ResourceManager()
+
+    class Model(Owner):
+        def __del__(self):
+            manager.release(self)
+
+    model = Model()
+    model.on_draw = model.__del__
+    texture = track_texture(manager, model)
+
+    del model
+    gc.collect()
+    assert deleted == [texture]
+    assert manager.report() == {}
+
+
+def test_owners_are_not_released_after_teardown(deleted):
+    manager = ResourceManager()
+    owner = Owner()
+    texture = track_texture(manager, owner)
+
+    manager.teardown()
+    assert deleted == [texture]
+
+    # Collecting the owner afterwards makes no OpenGL calls.
+    del owner
+    gc.collect()
+    assert deleted == [texture]
+
+
+def test_new_owners_do_not_inherit_objects(deleted):
+    manager = ResourceManager()
+    track_texture(manager, Owner())
+    gc.collect()
+
+    assert manager.bytes_owned(Owner()) == 0
+    assert manager.total_bytes() == 0
@@ -0,0 +1,83 @@
+import numpy as np
+import pygame
+import pytest
+
+from ecm3423.camera import Camera
+from ecm3423.scene import Scene
+from ecm3423.transforms import build_rotation_matrix_xy, build_translation_matrix
+
+STEP = 1.0 / 120
+
+
+@pytest.fixture
+def scene() -> Scene:
+    scene = Scene()
+    scene.redraw = False
+    scene.camera.changed = False
+    return scene
+
+
+def view(psi: float, phi: float) -> np.array:
+    return build_translation_matrix([0.0, 0.0, -Camera.distance]) @ build_rotation_matrix_xy(psi, phi)
+
+
+def test_idle_scene_does_not_need_redrawing(scene):
+    scene.update(STEP)
+    assert not scene.needs_redraw()
+
+
+def test_held_keys_need_continuous_redrawing(scene):
+    scene.held_keys.add(pygame.K_UP)
+    scene.update(STEP)
+    scene.camera.changed = False
+    assert scene.needs_redraw()
+
+    # Releasing the key draws one last frame, and then the scene is idle again.
+    scene.held_keys.clear()
+    scene.update(STEP)
+    assert scene.needs_redraw()
+    scene.redraw = False
+    scene.camera.changed = False
+    scene.update(STEP)
+    assert not scene.needs_redraw()
+
+
+def test_short_presses_take_effect(scene):
+    scene.pressed_keys.add(pygame.K_UP)
+    scene.update(STEP)
+
+    assert scene.camera.psi == pytest.approx(-scene.rot_speed * STEP)
+    assert scene.needs_redraw()
+
+
+def test_update_interpolates_from_previous_step(scene):
+    scene.held_keys.add(pygame.K_UP)
+    scene.update(STEP)
+    scene.update(STEP)
+    psi = scene.camera.psi
+
+    scene.camera.update(0.0)
+    np.testing.assert_allclose(scene.camera.V, view(psi + scene.rot_speed * STEP, 0.0), atol=1e-6)
+    scene.camera.update(0.5)
+    np.testing.assert_allclose(scene.camera.V, view(psi + scene.rot_speed * STEP / 2, 0.0), atol=1e-6)
+    scene.camera.update(1.0)
+    np.testing.assert_allclose(scene.camera.V, view(psi, 0.0), atol=1e-6)
+
+
+def test_wake_is_not_interpolated(scene):
+    scene.held_keys.add(pygame.K_UP)
+    scene.wake(STEP)
+    psi = scene.camera.psi
+    assert psi != 0.0
+    assert scene.needs_redraw()
+
+    # Every frame drawn before the next step shows the state after waking, rather than moving back towards the state
+    # before it.
+    for alpha in (0.0, 0.1, 0.5, 1.0):
+        scene.camera.update(alpha)
+        np.testing.assert_allclose(scene.camera.V, view(psi, 0.0), atol=1e-6)
+
+    # The next step is interpolated from there.
+    scene.update(STEP)
+    scene.camera.update(0.0)
+    np.testing.assert_allclose(scene.camera.V, view(psi, 0.0), atol=1e-6)
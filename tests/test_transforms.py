@@ -0,0 +1,154 @@
+import tracemalloc
+import warnings
+
+import numpy as np
+import pytest
+
+from ecm3423 import transforms, util
+
+# The util builders are deprecated, but are what the transforms builders must agree with.
+pytestmark = pytest.mark.filterwarnings("ignore::DeprecationWarning")
+
+ANGLES = [0.0, 0.3, -1.2, np.pi / 2, 2.5]
+
+
+@pytest.mark.parametrize("t", [[0.0, 0.0, 0.0], [1.0, -2.0, 3.5]])
+def test_translation_matrix(t):
+    np.testing.assert_allclose(transforms.build_translation_matrix(t), util.build_translation_matrix(t))
+
+
+def test_scale_matrix():
+    np.testing.assert_allclose(transforms.build_scale_matrix(1.0, 2.0, 0.5), util.build_scale_matrix(1.0, 2.0, 0.5))
+
+
+@pytest.mark.parametrize("axis", ["x", "y", "z"])
+@pytest.mark.parametrize("angle", ANGLES)
+def test_rotation_matrix(axis, angle):
+    name = f"build_rotation_matrix_{axis}"
+    np.testing.assert_allclose(getattr(transforms, name)(angle), getattr(util, name)(angle), atol=1e-6)
+
+
+@pytest.mark.parametrize("psi", ANGLES)
+@pytest.mark.parametrize("phi", ANGLES)
+def test_rotation_matrix_xy(psi, phi):
+    np.testing.assert_allclose(transforms.build_rotation_matrix_xy(psi, phi), util.build_rotation_matrix_xy(psi, phi),
+                               atol=1e-6)
+
+
+def test_frustum_matrix():
+    args = (-1.0, 1.0, 1.0, -1.0, 1.5, 50)
+    np.testing.assert_allclose(transforms.build_frustum_matrix(*args), util.build_frustum_matrix(*args), rtol=1e-6)
+
+
+@pytest.mark.parametrize("orientation", ANGLES)
+def test_pose_matrix(orientation):
+    position, scale = [1.0, 2.0, -3.0], [0.5, 2.0, 1.5]
+    np.testing.assert_allclose(transforms.build_pose_matrix(position, orientation, scale),
+                               util.build_pose_matrix(position, orientation, scale), atol=1e-6)
+
+
+def test_homogenise():
+    vec = transforms.homogenise([1.0, 2.0, 3.0])
+    np.testing.assert_allclose(vec, util.homogenise([1.0, 2.0, 3.0]))
+    np.testing.assert_allclose(transforms.unhomogenise(vec * 2.0), util.unhomogenise(vec * 2.0))
+
+
+def test_builders_are_float32():
+    assert transforms.build_pose_matrix().dtype == np.float32
+    assert transforms.build_rotation_matrix_xy(0.3, 0.2).dtype == np.float32
+    assert transforms.build_frustum_matrix(-1.0, 1.0, 1.0, -1.0, 1.5, 50).dtype == np.float32
+
+
+def test_output_buffer_is_written_in_place():
+    out = np.full((4, 4), np.nan, dtype="f")
+    assert transforms.build_rotation_matrix_xy(0.3, 0.2, out=out) is out
+    np.testing.assert_allclose(out, util.build_rotation_matrix_xy(0.3, 0.2), atol=1e-6)
+
+    # Builders which only set some elements must still overwrite the rest.
+    out[...] = np.nan
+    np.testing.assert_allclose(transforms.build_translation_matrix([1.0, 2.0, 3.0], out=out),
+                               util.build_translation_matrix([1.0, 2.0, 3.0]))
+
+
+@pytest.mark.parametrize("out", [np.empty((3, 3), "f"), np.empty((4, 4), "d")])
+def test_invalid_output_buffer(out):
+    with pytest.raises(ValueError):
+        transforms.build_pose_matrix(out=out)
+
+
+@pytest.mark.parametrize("uniform", [False, True])
+def test_pose_matrices(uniform):
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-5.0, 5.0, (20, 3))
+    orientations = rng.uniform(-np.pi, np.pi, 20)
+    scales = rng.uniform(0.1, 2.0, 20 if uniform else (20, 3))
+
+    M = transforms.build_pose_matrices(positions, orientations, scales)
+    assert M.shape == (20, 4, 4)
+    for i in range(20):
+        scale = [scales[i]] * 3 if uniform else scales[i]
+        np.testing.assert_allclose(M[i], util.build_pose_matrix(positions[i], orientations[i], scale), atol=1e-5)
+
+
+def test_pose_matrices_defaults():
+    positions = np.array([[1.0, 2.0, 3.0], [-1.0, 0.0, 4.0]])
+    M = transforms.build_pose_matrices(positions)
+    for i in range(2):
+        np.testing.assert_allclose(M[i], util.build_translation_matrix(positions[i]))
+
+
+@pytest.mark.parametrize("orientations, scales", [(True, None), (None, "uniform"), (None, "axes")])
+def test_pose_matrices_partial(orientations, scales):
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-5.0, 5.0, (20, 3))
+    orientations = rng.uniform(-np.pi, np.pi, 20) if orientations else None
+    scales = {None: None, "uniform": rng.uniform(0.1, 2.0, 20), "axes": rng.uniform(0.1, 2.0, (20, 3))}[scales]
+
+    out = np.full((20, 4, 4), np.nan, dtype="f")
+    assert transforms.build_pose_matrices(positions, orientations, scales, out=out) is out
+    np.testing.assert_allclose(out, transforms.build_pose_matrices(
+        positions, np.zeros(20) if orientations is None else orientations, np.ones(20) if scales is None else scales))
+
+
+@pytest.mark.parametrize("build, args", [
+    (transforms.build_pose_matrices, [(3,), (), ()]),
+    (transforms.build_pose_matrices, [(3,), (), (3,)]),
+    (transforms.build_rotation_matrices_xy, [(), ()]),
+])
+def test_batched_builders_do_not_allocate(build, args):
+    n = 10000
+    args = [np.ones((n,) + shape, "f") for shape in args]
+    out = np.empty((n, 4, 4), "f")
+
+    tracemalloc.start()
+    try:
+        build(*args, out=out)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # Nothing as large as a single column of the output may be allocated.
+    assert peak < n * out.itemsize
+
+
+def test_rotation_matrices_xy():
+    psi, phi = np.array(ANGLES), np.array(ANGLES[::-1])
+    R = transforms.build_rotation_matrices_xy(psi, phi)
+    for i in range(len(ANGLES)):
+        np.testing.assert_allclose(R[i], util.build_rotation_matrix_xy(psi[i], phi[i]), atol=1e-6)
+
+
+@pytest.mark.filterwarnings("error::DeprecationWarning")
+def test_util_builders_are_deprecated():
+    with pytest.warns(DeprecationWarning, match="ecm3423.transforms.build_frustum_matrix"):
+        util.build_frustum_matrix(-1.0, 1.0, 1.0, -1.0, 1.5, 50)
+
+
+@pytest.mark.parametrize("build", [lambda: util.build_rotation_matrix_xy(0.3, 0.2), lambda: util.build_pose_matrix()])
+def test_util_builders_warn_once(build):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        build()
+
+    assert len(caught) == 1
+    assert caught[0].filename == __file__